@@ -0,0 +1,50 @@
+"""Memo table for NgramModel.backoff, optionally bounded as an LRU cache."""
+
+import collections
+
+
+class BackoffCache:
+    """Backoff probabilities keyed on (order, context, unit), with hit/miss counters.
+
+    Parameters
+    ----------
+    max_size: int (default None)
+       number of entries kept; past it the least recently used entry is dropped.
+       None keeps every entry.
+    """
+
+    def __init__(self, max_size=None):
+        self.max_size = max_size
+        self.table = collections.OrderedDict() if max_size is not None else {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Cached probability for key, or None (counted as a miss)."""
+        value = self.table.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        if self.max_size is not None:
+            self.table.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        self.table[key] = value
+        if self.max_size is not None and len(self.table) > self.max_size:
+            self.table.popitem(last=False)
+
+    def update(self, items):
+        """Store many (key, value) pairs without touching the counters."""
+        for key, value in items:
+            self.put(key, value)
+
+    def info(self):
+        """Counters and size, to help choose max_size."""
+        lookups = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self.table), 'max_size': self.max_size,
+                'hit_rate': self.hits / lookups if lookups else 0.0}
+
+    def __len__(self):
+        return len(self.table)
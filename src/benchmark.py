@@ -0,0 +1,263 @@
+"""Benchmark the hot paths of generation, scoring and minimal-pair counting.
+
+Wordforms are subsampled from the raw lexica in data/raw at several sizes, and
+for every size and n-gram order each benchmark reports its best and median
+wall-clock time over a few runs, its throughput, and the peak memory it
+allocates (traced by tracemalloc in one extra run). The cold start of the entry
+points (a fresh interpreter importing each of them) is timed as well. Log-log slopes of time
+against size summarize how each benchmark scales. Results are written as JSON,
+and two result files can be compared to spot regressions between versions.
+
+Run from the root of the repository:
+
+    python src/benchmark.py --languages english german --sizes 1000 5000 --orders 3 4
+    python src/benchmark.py --compare logs/benchmark_old.json logs/benchmark_new.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+
+import config
+from compiled_model import compile_model
+from generate_artificial_lexicon import build_lexicon, build_lexicon_by_length
+from homophones import HomophoneIndex
+from length_sampler import LengthConditionedSampler
+from minimal_pairs import find_minimal_pairs
+from preprocess import create_model
+from raw_lexicon import remap_transcriptions
+from utils import count_syllables_batch
+
+
+# Raw lexicon of each language: path, separator and phonetic column.
+RAW_LEXICA = {'english': ('data/raw/english/celex_all.csv', '\\', 'PhonDISC'),
+              'german': ('data/raw/german/celex_german_all.csv', '\\', 'PhonDISC'),
+              'dutch': ('data/raw/dutch/celex_dutch_all.csv', '\\', 'PhonDISC'),
+              'japanese': (config.LEXICON_PATHS['japanese'][0], config.LEXICON_PATHS['japanese'][1], 'phonetic_form')}
+
+SIZES = [1000, 5000, 20000]
+ORDERS = [3, 4, 5]
+# Entry points whose import time is reported as cold start.
+ENTRY_POINTS = ['generate_artificial_lexicon', 'minimal_pairs', 'preprocess', 'generative_model', 'utils']
+BENCHMARKS = ['create_model', 'create_model_compiled', 'evaluate', 'evaluate_batch', 'generate_one',
+              'generate_batch', 'build_lexicon', 'build_lexicon_by_length', 'find_minimal_pairs']
+
+
+def load_wordforms(language):
+    """Distinct phonetic wordforms of a raw lexicon, in order of first occurrence."""
+    path, sep, column = RAW_LEXICA[language]
+    forms = pd.read_csv(path, sep=sep, usecols=[column], engine='python' if sep is None else 'c')[column].dropna()
+    if language == 'japanese':
+        forms = pd.Series(remap_transcriptions(forms[~forms.str.contains("/", regex=False)], language))
+    forms = forms[forms.str.len() > 0]
+    return HomophoneIndex.from_values(forms).forms.tolist()
+
+
+def subsample(wordforms, size, seed=0):
+    """size wordforms drawn without replacement (all of them if size is None or too large)."""
+    if size is None or size >= len(wordforms):
+        return list(wordforms)
+    rng = np.random.default_rng(seed)
+    return [wordforms[i] for i in np.sort(rng.choice(len(wordforms), size, replace=False))]
+
+
+def measure(func, repeat=3, memory=True):
+    """Best and median time of repeat calls of func, and the peak memory traced during one more."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    result = {'seconds': min(times), 'median_seconds': float(np.median(times)), 'runs': repeat}
+    if memory:
+        tracemalloc.start()
+        try:
+            func()
+            result['peak_bytes'] = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return result
+
+
+def cold_start(modules=ENTRY_POINTS, repeat=3):
+    """Seconds to start a fresh interpreter and import each module, best of repeat.
+
+    'net_seconds' subtracts the start-up of an interpreter importing nothing."""
+    src = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [src, os.environ.get('PYTHONPATH')])))
+
+    def best(code):
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, '-c', code], env=env, check=True)
+            times.append(time.perf_counter() - start)
+        return min(times)
+
+    baseline = best("pass")
+    return [{'module': module, 'seconds': seconds, 'net_seconds': seconds - baseline}
+            for module, seconds in ((module, best("import " + module)) for module in modules)]
+
+
+def benchmark_cases(wordforms, language, n, smoothing=.01, num_generate=1000, seed=0):
+    """(name, number of items processed, function) of every benchmark on these wordforms."""
+    vowels = config.VOWEL_SETS[language]
+    lm = create_model(wordforms, n=n, smoothing=smoothing)
+    compiled = compile_model(lm)
+    sylls = count_syllables_batch(wordforms, language=language, vowels=vowels)
+    # Lexica as large as the sample, matched on syllables as in config.MODEL_INFO.
+    length_dist = Counter(s for s in sylls.tolist() if s > 0)
+    num_words = sum(length_dist.values())
+    counts = dict.fromkeys(wordforms, 0)
+
+    def generate_one():
+        random.seed(seed)
+        return [lm.generate_one(n) for _ in range(num_generate)]
+
+    def build_by_length():
+        sampler = LengthConditionedSampler(compiled, vowels=vowels, language=language, match_on='sylls',
+                                           max_length=max(length_dist))
+        return build_lexicon_by_length(sampler, language, length_dist, vowels, match_on='sylls',
+                                       rng=np.random.default_rng(seed))
+
+    cases = {
+        'create_model': (len(wordforms), lambda: create_model(wordforms, n=n, smoothing=smoothing)),
+        'create_model_compiled': (len(wordforms),
+                                  lambda: create_model(wordforms, n=n, smoothing=smoothing, compiled=True)),
+        'evaluate': (len(wordforms), lambda: [lm.evaluate(w) for w in wordforms]),
+        'evaluate_batch': (len(wordforms), lambda: compiled.evaluate_batch(wordforms)),
+        'generate_one': (num_generate, generate_one),
+        'generate_batch': (num_generate, lambda: compiled.generate_batch(num_generate, rng=np.random.default_rng(seed))),
+        'build_lexicon': (num_words, lambda: build_lexicon(compiled, language, length_dist, vowels, wordforms,
+                                                           match_on='sylls', rng=np.random.default_rng(seed))),
+        'build_lexicon_by_length': (num_words, build_by_length),
+        'find_minimal_pairs': (len(wordforms), lambda: find_minimal_pairs(wordforms, counts)),
+    }
+    return [(name,) + cases[name] for name in BENCHMARKS]
+
+
+def run(languages, sizes=SIZES, orders=ORDERS, benchmarks=None, repeat=3, memory=True, seed=0, verbose=True):
+    """Results of every benchmark for each language, subsample size and order.
+
+    Returns
+    -------
+    dict
+       'environment' (versions, machine and commit), 'parameters', 'cold_start'
+       (import time of the entry points), 'results' (one record per
+       language, size, order and benchmark), 'scaling' (log-log
+       slope of time against size) and 'skipped' (languages whose raw lexicon
+       could not be read, with the reason)
+    """
+    benchmarks = BENCHMARKS if benchmarks is None else benchmarks
+    imports = cold_start(repeat=repeat)
+    if verbose:
+        for record in imports:
+            print("import {module}: {seconds:.3f}s".format(**record))
+    results, skipped = [], {}
+    for language in languages:
+        try:
+            wordforms = load_wordforms(language)
+        except (OSError, KeyError, ValueError) as error:
+            skipped[language] = str(error)
+            if verbose:
+                print("Skipping {lan}: {e}".format(lan=language, e=error))
+            continue
+        for size in sizes:
+            sample = subsample(wordforms, size, seed=seed)
+            for n in orders:
+                for name, items, func in benchmark_cases(sample, language, n, seed=seed):
+                    if name not in benchmarks:
+                        continue
+                    record = {'language': language, 'size': len(sample), 'n': n, 'benchmark': name, 'items': items}
+                    record.update(measure(func, repeat=repeat, memory=memory))
+                    record['items_per_second'] = items / record['seconds'] if record['seconds'] > 0 else None
+                    results.append(record)
+                    if verbose:
+                        print("{language} size={size} n={n} {benchmark}: {seconds:.4f}s".format(**record))
+    return {'environment': environment(),
+            'parameters': {'languages': list(languages), 'sizes': list(sizes), 'orders': list(orders),
+                           'benchmarks': list(benchmarks), 'repeat': repeat, 'seed': seed},
+            'cold_start': imports,
+            'results': results,
+            'scaling': scaling(results),
+            'skipped': skipped}
+
+
+def scaling(results):
+    """Slope of log(time) against log(size) for each language, order and benchmark (1 = linear)."""
+    df = pd.DataFrame(results)
+    slopes = []
+    if df.empty:
+        return slopes
+    for (language, n, name), group in df.groupby(['language', 'n', 'benchmark'], sort=False):
+        group = group[group['seconds'] > 0]
+        if group['size'].nunique() < 2:
+            continue
+        slope = np.polyfit(np.log(group['size']), np.log(group['seconds']), 1)[0]
+        slopes.append({'language': language, 'n': int(n), 'benchmark': name, 'slope': float(slope),
+                       'sizes': group['size'].tolist(), 'seconds': group['seconds'].tolist()})
+    return slopes
+
+
+def environment():
+    """Versions, machine and commit the benchmarks ran on."""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {'commit': commit, 'time': time.strftime("%Y-%m-%dT%H:%M:%S"), 'python': platform.python_version(),
+            'numpy': np.__version__, 'pandas': pd.__version__, 'platform': platform.platform(),
+            'processor': platform.processor(), 'cpu_count': os.cpu_count()}
+
+
+def compare(old, new):
+    """Time and memory of each benchmark in new relative to old (ratios > 1 are slower or larger)."""
+    keys = ['language', 'size', 'n', 'benchmark']
+
+    def records(report):
+        imports = [{'language': '', 'size': 0, 'n': 0, 'benchmark': 'import ' + r['module'], 'seconds': r['seconds']}
+                   for r in report.get('cold_start', [])]
+        return pd.DataFrame(imports + report['results']).set_index(keys)
+
+    df_old, df_new = records(old), records(new)
+    both = df_old.join(df_new, how='inner', lsuffix='_old', rsuffix='_new')
+    table = pd.DataFrame({'seconds_old': both['seconds_old'], 'seconds_new': both['seconds_new'],
+                          'time_ratio': both['seconds_new'] / both['seconds_old']})
+    if 'peak_bytes_old' in both and 'peak_bytes_new' in both:
+        table['memory_ratio'] = both['peak_bytes_new'] / both['peak_bytes_old']
+    return table.reset_index()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument('--languages', nargs='+', default=['english', 'german', 'dutch', 'japanese'])
+    parser.add_argument('--sizes', nargs='+', type=int, default=SIZES)
+    parser.add_argument('--orders', nargs='+', type=int, default=ORDERS)
+    parser.add_argument('--benchmarks', nargs='+', choices=BENCHMARKS, default=BENCHMARKS)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-memory', action='store_true', help="skip the extra run tracing peak memory")
+    parser.add_argument('--output', default=None, help="JSON file (default logs/benchmark_<time>.json)")
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help="compare two result files and exit")
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare[0]) as f_old, open(args.compare[1]) as f_new:
+            print(compare(json.load(f_old), json.load(f_new)).to_string(index=False))
+    else:
+        report = run(args.languages, sizes=args.sizes, orders=args.orders, benchmarks=args.benchmarks,
+                     repeat=args.repeat, memory=not args.no_memory, seed=args.seed)
+        output = args.output or "logs/benchmark_{t}.json".format(t=time.strftime("%Y%m%d-%H%M%S"))
+        with open(output, "w") as f:
+            json.dump(report, f, indent=2)
+        print("Results saved to {path}".format(path=output))
@@ -0,0 +1,167 @@
+"""Check the fast paths against the straightforward code they replaced, on a subsample of a lexicon.
+
+- models: NgramCounts, compiled, gives exactly the model the original
+  dict-based NgramModel training gives. The arrays are equal, and evaluate_batch
+  returns the reference evaluate bit for bit, on held-out and unseen words.
+- minimal_pairs: find_minimal_pairs, with 1 process and with several, counts
+  the same neighbours as comparing every pair of words with editdistance.
+- seeds: the lexica built from one seed do not depend on the number of worker
+  processes, in both generation modes.
+
+Run from the root of the repository; the exit status is 1 if any check fails:
+
+    python src/check_equivalence.py --language english --size 2000 --orders 2 3 4
+"""
+
+import argparse
+import collections
+import itertools
+import sys
+
+import editdistance
+import numpy as np
+
+import config
+from benchmark import RAW_LEXICA, load_wordforms, subsample
+from compiled_model import PAD, END, compile_model
+from generate_artificial_lexicon import build_lexicon, build_lexicon_by_length
+from generative_model import NgramModel
+from length_sampler import LengthConditionedSampler
+from minimal_pairs import find_minimal_pairs
+from ngram_counts import NgramCounts
+from parallel_generation import generate_lexica
+from utils import count_syllables_batch
+
+
+CHECKS = ['models', 'minimal_pairs', 'seeds']
+
+
+class ReferenceNgramModel(NgramModel):
+    """NgramModel trained by the original dict-based loop, one n-gram at a time."""
+
+    def create_model(self, corpus, smoothing=0):
+        unigrams = []
+        for item in corpus:
+            for k in range(1, self.n + 1):
+                symbols = [PAD] * (k - 1) + list(item) + [END]
+                for ng in zip(*(symbols[j:] for j in range(k))):
+                    self.cfd[k]["".join(ng[:-1])][ng[-1]] += 1.0
+                    unigrams += [ng[-1]]
+        U = len(set(unigrams))
+        self.units = list(set(unigrams))
+        self.smoothing = smoothing
+        for k in self.cfd.keys():
+            for i in self.cfd[k].keys():
+                pbak = 0
+                for j in self.cfd[k][i].keys():
+                    self.cpd[k][i][j] = (self.cfd[k][i][j] + smoothing) / float(sum(self.cfd[k][i].values()) + smoothing * U)
+                    pbak += self.cpd[k - 1][i[1:]][j]
+                if self.smoothing:
+                    self.alpha[k][i] = (1 - sum(self.cpd[k][i].values())) / float(1 - pbak)
+
+
+def reference_minimal_pairs(wordforms, counts):
+    """Minimal pair counts of every pair of wordforms one edit apart, by brute force."""
+    word_to_size = collections.defaultdict(int)
+    word_to_size_with_homophones = collections.defaultdict(int)
+    for w1, w2 in itertools.combinations(wordforms, 2):
+        if editdistance.eval(w1, w2) == 1:
+            word_to_size[w1] += 1
+            word_to_size[w2] += 1
+            word_to_size_with_homophones[w1] += counts[w2] + 1
+            word_to_size_with_homophones[w2] += counts[w1] + 1
+    return word_to_size, word_to_size_with_homophones
+
+
+def check_models(wordforms, orders, smoothings=(0, .01), seed=0):
+    """Failures of counted and compiled models against ReferenceNgramModel, for each order and smoothing."""
+    rng = np.random.default_rng(seed)
+    held_out = rng.permutation(len(wordforms)) < len(wordforms) // 4
+    train = [w for w, test in zip(wordforms, held_out) if not test]
+    test = [w for w, t in zip(wordforms, held_out) if t] + ["", "".join(sorted(set("".join(wordforms)))), "æø"]
+    failures = []
+    for n, smoothing in itertools.product(orders, smoothings):
+        reference = ReferenceNgramModel(n, train, 1)
+        reference.create_model(train, smoothing)
+        expected = compile_model(reference)
+        counted = NgramCounts(n).update(train).compile(smoothing)
+        label = "n={n} smoothing={s}".format(n=n, s=smoothing)
+        if counted.units != expected.units:
+            failures.append("{l}: units differ".format(l=label))
+            continue
+        for name in ('context_keys', 'alphas', 'pair_keys', 'pair_probs'):
+            if not np.array_equal(getattr(counted, name), getattr(expected, name)):
+                failures.append("{l}: {a} differ".format(l=label, a=name))
+        lengths, oov, log_probs = zip(*(reference.evaluate(w) for w in test))
+        batch = counted.evaluate_batch(test)
+        for name, values, batch_values in zip(('lengths', 'OOV counts', 'log probabilities'),
+                                              (lengths, oov, log_probs), batch):
+            if not np.array_equal(np.array(values), batch_values):
+                failures.append("{l}: evaluate_batch {v} differ from evaluate".format(l=label, v=name))
+    return failures
+
+
+def check_minimal_pairs(wordforms, processes=(1, 3), seed=0):
+    """Failures of find_minimal_pairs against reference_minimal_pairs."""
+    rng = np.random.default_rng(seed)
+    # Some homophones, so the counts weighted by homophones are exercised too.
+    counts = dict(zip(wordforms, rng.integers(0, 3, len(wordforms)).tolist()))
+    expected = [dict(sizes) for sizes in reference_minimal_pairs(wordforms, counts)]
+    failures = []
+    for p in processes:
+        found = [{w: s for w, s in sizes.items() if s} for sizes in find_minimal_pairs(wordforms, counts, processes=p)]
+        if found != expected:
+            failures.append("processes={p}: minimal pair counts differ from editdistance".format(p=p))
+    return failures
+
+
+def check_seeds(wordforms, language, n=3, iterations=4, processes=(1, 2, 3), seed=0):
+    """Failures of lexica built from one seed with different numbers of processes."""
+    vowels = config.VOWEL_SETS[language]
+    model = NgramCounts(n).update(wordforms).compile(.01)
+    sylls = count_syllables_batch(wordforms, language=language, vowels=vowels)
+    length_dist = collections.Counter(s for s in sylls.tolist() if s > 0)
+    modes = {'rejection': (build_lexicon, {'lm': model, 'original_lexicon': wordforms}),
+             'conditioned': (build_lexicon_by_length,
+                             {'sampler': LengthConditionedSampler(model, vowels=vowels, language=language,
+                                                                  match_on='sylls', max_length=max(length_dist))})}
+    failures = []
+    for mode, (build, build_args) in modes.items():
+        runs = [generate_lexica(build, iterations, seed=seed, processes=p, language=language,
+                                length_dist=length_dist, vowels=vowels, match_on='sylls', **build_args)[0]
+                for p in processes]
+        for p, lexica in zip(processes[1:], runs[1:]):
+            if not all(a.equals(b) for a, b in zip(runs[0], lexica)):
+                failures.append("{m}: lexica with processes={p} differ from processes={q}".format(
+                    m=mode, p=p, q=processes[0]))
+    return failures
+
+
+def run(language, size, orders, checks=CHECKS, seed=0):
+    """Failures of each check on a subsample of size wordforms of language."""
+    wordforms = subsample(load_wordforms(language), size, seed=seed)
+    results = {}
+    if 'models' in checks:
+        results['models'] = check_models(wordforms, orders, seed=seed)
+    if 'minimal_pairs' in checks:
+        results['minimal_pairs'] = check_minimal_pairs(wordforms, seed=seed)
+    if 'seeds' in checks:
+        results['seeds'] = check_seeds(wordforms, language, seed=seed)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument('--language', default='english', choices=list(RAW_LEXICA))
+    parser.add_argument('--size', type=int, default=2000, help="wordforms in the subsample")
+    parser.add_argument('--orders', nargs='+', type=int, default=[2, 3, 4])
+    parser.add_argument('--checks', nargs='+', choices=CHECKS, default=CHECKS)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    results = run(args.language, args.size, args.orders, checks=args.checks, seed=args.seed)
+    for check, failures in results.items():
+        print("{c}: {r}".format(c=check, r="ok" if not failures else "FAILED"))
+        for failure in failures:
+            print("  " + failure)
+    sys.exit(1 if any(results.values()) else 0)
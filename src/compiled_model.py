@@ -0,0 +1,451 @@
+"""Compact, array-backed version of a trained NgramModel.
+
+Phonemes are integer-coded and every context is packed into a single int64 key,
+so the nested defaultdicts of NgramModel become four sorted NumPy arrays shared by
+all n-gram orders. Probabilities are looked up with np.searchsorted and backed off
+with exactly the same arithmetic as NgramModel.backoff, so log-probabilities are
+bit-for-bit identical to the original model."""
+
+import json
+import os
+import random
+from math import log
+
+import numpy as np
+
+
+PAD = "["
+END = "]"
+
+# Query batches larger than this are sorted before searching the key tables.
+_SORT_THRESHOLD = 4096
+# Distinct words scored per padded array by evaluate_batch.
+_BATCH_WORDS = 50000
+# Number of states whose sampling tables are built per vectorized pass.
+_TABLE_CHUNK = 8192
+# Arrays written by CompiledNgramModel.save, in constructor order.
+_ARRAYS = ('context_keys', 'alphas', 'pair_keys', 'pair_probs')
+
+
+class CompiledNgramModel:
+    """Frozen n-gram model stored as contiguous arrays.
+
+    Symbol codes: 0 is the start pad '[', 1..V are the (sorted) units of the
+    model and V+1 stands for any symbol never seen in training. A context of
+    k-1 symbols is packed as the base-B integer of its codes (B = V+2), and the
+    keys of all orders share one sorted table by adding B**(k-1) to contexts
+    and B**k to (context, unit) pairs of order k.
+
+    A partial model shares its key tables with other models (see
+    ngram_counts.SplitNgramCounts.compile) and only has some of their contexts
+    and pairs: the others have a NaN backoff weight or probability, and are
+    looked up as if they were not in the tables.
+    """
+
+    def __init__(self, n, smoothing, units, context_keys, alphas, pair_keys, pair_probs, partial=False):
+        self.n = n
+        self.smoothing = smoothing
+        self.units = list(units)
+        self.unit_index = {u: i + 1 for i, u in enumerate(self.units)}
+        self.unit_index[PAD] = 0
+        self.oov = len(self.units) + 1
+        self.base = len(self.units) + 2
+        if self.base ** n >= 2 ** 62:
+            raise ValueError("Alphabet of {v} units is too large for a {n}-gram model.".format(
+                v=len(self.units), n=n))
+        self.end = self.unit_index[END]
+        self.context_mod = self.base ** (n - 1)
+        # powers[k-1] == B**(k-1): modulus and tag offset of order-k contexts.
+        self.powers = self.base ** np.arange(n, dtype=np.int64)
+        self.context_keys = context_keys
+        self.alphas = alphas
+        self.pair_keys = pair_keys
+        self.pair_probs = pair_probs
+        self.partial = partial
+        self._cumprobs = None
+
+    @classmethod
+    def from_model(cls, lm):
+        """Compile a trained NgramModel."""
+        units = sorted(lm.units)
+        base = len(units) + 2
+        codes = {u: i + 1 for i, u in enumerate(units)}
+        codes[PAD] = 0
+        context_keys, alphas, pair_keys, pair_probs = [], [], [], []
+        for k in range(1, lm.n + 1):
+            # cfd is never touched by lookups, so its keys are exactly the seen contexts.
+            for h in lm.cfd[k].keys():
+                key = _pack(h, codes, base)
+                context_keys.append(key + base ** (k - 1))
+                alphas.append(lm.alpha[k][h] if h in lm.alpha[k] else 1.0)
+                for c, p in lm.cpd[k][h].items():
+                    pair_keys.append(key * base + codes[c] + base ** k)
+                    pair_probs.append(p)
+        context_keys = np.array(context_keys, dtype=np.int64)
+        order = np.argsort(context_keys)
+        pair_keys = np.array(pair_keys, dtype=np.int64)
+        pair_order = np.argsort(pair_keys)
+        return cls(lm.n, lm.smoothing, units,
+                   context_keys[order], np.array(alphas, dtype=np.float64)[order],
+                   pair_keys[pair_order], np.array(pair_probs, dtype=np.float64)[pair_order])
+
+    def encode(self, word):
+        """Integer-code a word, with start padding and the end symbol."""
+        get = self.unit_index.get
+        return np.array([0] * (self.n - 1) + [get(ch, self.oov) for ch in word] + [self.end],
+                        dtype=np.int64)
+
+    def context_keys_for(self, codes):
+        """Packed (n-1)-symbol context preceding every non-pad position of an encoded word."""
+        num = len(codes) - (self.n - 1)
+        keys = np.zeros(num, dtype=np.int64)
+        for j in range(self.n - 1):
+            keys = keys * self.base + codes[j:j + num]
+        return keys
+
+    def backoff_array(self, contexts, units, order=None):
+        """Vectorized NgramModel.backoff.
+
+        Parameters
+        ----------
+        contexts: np.ndarray
+           packed contexts of (order-1) symbols
+        units: np.ndarray
+           unit codes to score in each context
+        order: int (default self.n)
+           n-gram order the backoff starts from
+        """
+        order = self.n if order is None else order
+        contexts, units = np.broadcast_arrays(np.asarray(contexts, dtype=np.int64),
+                                              np.asarray(units, dtype=np.int64))
+        shape = contexts.shape
+        contexts, units = contexts.ravel(), units.ravel()
+        value = np.zeros(len(contexts), dtype=np.float64)
+        pending = np.arange(len(contexts))
+        weights = []
+        # Resolve every query at the highest order it was seen in, remembering the
+        # backoff weights of the orders it fell through.
+        for k in range(order, 0, -1):
+            ctx = contexts[pending] % self.powers[k - 1]
+            found, idx = self._find_pairs(ctx * self.base + units[pending] + self.powers[k - 1] * self.base)
+            value[pending[found]] = self.pair_probs[idx[found]]
+            ctx = ctx[~found]
+            pending = pending[~found]
+            seen, idx = self._find_contexts(ctx + self.powers[k - 1])
+            weights.append((pending, np.where(seen, self.alphas[idx], 1.0)))
+        # Lowest order first, so each weight multiplies the already backed-off value
+        # exactly as the recursion in NgramModel.backoff does.
+        for pending, alphas in reversed(weights):
+            value[pending] = alphas * value[pending]
+        return value.reshape(shape)
+
+    def _find_pairs(self, queries):
+        """_find in pair_keys, leaving out the pairs a partial model does not have."""
+        found, idx = _find(self.pair_keys, queries)
+        if self.partial:
+            found &= ~np.isnan(self.pair_probs[idx])
+        return found, idx
+
+    def _find_contexts(self, queries):
+        """_find in context_keys, leaving out the contexts a partial model does not have."""
+        found, idx = _find(self.context_keys, queries)
+        if self.partial:
+            found &= ~np.isnan(self.alphas[idx])
+        return found, idx
+
+    def backoff(self, n, h, c):
+        """Same signature and result as NgramModel.backoff."""
+        key = _pack(h, self.unit_index, self.base, self.oov)
+        return float(self.backoff_array(key, self.unit_index.get(c, self.oov), order=n))
+
+    def backoff_table(self, n, contexts):
+        """backoff(n, h, u) for every context string h (of n-1 symbols) and every unit u.
+
+        Returns
+        -------
+        np.ndarray
+           one row per context, one column per unit in self.units order
+        """
+        keys = np.array([_pack(h, self.unit_index, self.base, self.oov) for h in contexts], dtype=np.int64)
+        units = np.arange(1, len(self.units) + 1)
+        return self.backoff_array(keys[:, None], units[None, :], order=n)
+
+    def evaluate(self, word):
+        """ get the log probability of generating a given word under the language model """
+        codes = self.encode(word)
+        probs = self.backoff_array(self.context_keys_for(codes), codes[self.n - 1:])
+        p = 0
+        oov = 0
+        for pbak in probs.tolist():
+            if pbak != 0:
+                p += log(pbak, 10)
+            else:
+                oov += 1
+        return len(probs), oov, p
+
+    def evaluate_batch(self, wordforms):
+        """Vectorized evaluate over many words.
+
+        Each distinct wordform is scored once: words are integer-coded into padded
+        arrays, every position is backed off in one pass per chunk, and the
+        log-probabilities of a word are summed in order, as evaluate does.
+
+        Returns
+        -------
+        (np.ndarray, np.ndarray, np.ndarray)
+           lengths (counting the end symbol), OOV counts and log10 probabilities,
+           aligned with wordforms
+        """
+        index = {}
+        inverse = np.array([index.setdefault(w, len(index)) for w in wordforms], dtype=np.intp)
+        unique = list(index)
+        lengths = np.zeros(len(unique), dtype=np.int64)
+        oov = np.zeros(len(unique), dtype=np.int64)
+        log_probs = np.zeros(len(unique), dtype=np.float64)
+        for start in range(0, len(unique), _BATCH_WORDS):
+            rows = slice(start, start + _BATCH_WORDS)
+            lengths[rows], oov[rows], log_probs[rows] = self._evaluate_padded(unique[rows])
+        return lengths[inverse], oov[inverse], log_probs[inverse]
+
+    def _evaluate_padded(self, words):
+        """evaluate_batch for distinct words, as one padded array."""
+        get = self.unit_index.get
+        sizes = np.array([len(w) for w in words], dtype=np.int64) + 1
+        points = np.frombuffer("".join(words).encode("utf-32-le"), dtype=np.uint32)
+        symbols, symbol_index = np.unique(points, return_inverse=True)
+        lookup = np.array([get(chr(c), self.oov) for c in symbols.tolist()], dtype=np.int64)
+        width = int(sizes.max()) if len(words) else 0
+        mask = np.arange(width) < sizes[:, None]
+        # Start padding, then each word's codes and its end symbol.
+        codes = np.zeros((len(words), self.n - 1 + width), dtype=np.int64)
+        body = np.full((len(words), width), self.end, dtype=np.int64)
+        body[np.arange(width) < sizes[:, None] - 1] = lookup[symbol_index.ravel()]
+        codes[:, self.n - 1:] = body
+        contexts = np.zeros((len(words), width), dtype=np.int64)
+        for j in range(self.n - 1):
+            contexts = contexts * self.base + codes[:, j:j + width]
+        probs = self.backoff_array(contexts[mask], body[mask])
+        seen = probs != 0
+        values = np.zeros(len(probs), dtype=np.float64)
+        values[seen] = log10_probs(probs[seen])
+        logs = np.zeros((len(words), width), dtype=np.float64)
+        logs[mask] = values
+        oov = np.zeros((len(words), width), dtype=np.int64)
+        oov[mask] = ~seen
+        # cumsum adds along each row one term at a time, like evaluate's loop.
+        log_probs = np.cumsum(logs, axis=1)[:, -1] if width else np.zeros(len(words))
+        return sizes, oov.sum(axis=1), log_probs
+
+    def sampling_states(self, contexts, max_orders=None):
+        """Map packed (n-1)-symbol contexts to sampling states.
+
+        A state is the index in context_keys of the longest seen suffix of the
+        context, whose backoff distribution every such context shares. Without
+        smoothing only the full context is used, and unseen contexts get -1.
+        max_orders optionally caps the order of the suffix used for each context."""
+        powers = self.powers if self.smoothing else self.powers[-1:]
+        contexts = np.asarray(contexts, dtype=np.int64)[..., None] % powers + powers
+        seen, idx = self._find_contexts(contexts)
+        if max_orders is not None:
+            orders = np.arange(self.n - len(powers) + 1, self.n + 1)
+            seen &= orders <= np.asarray(max_orders)[..., None]
+        # Orders run upwards along the last axis, so the last seen one is the longest.
+        longest = seen.shape[-1] - 1 - np.argmax(seen[..., ::-1], axis=-1)
+        states = np.take_along_axis(idx, longest[..., None], axis=-1)[..., 0]
+        return np.where(seen.any(axis=-1), states, -1)
+
+    def _sampling_state(self, context):
+        """Scalar sampling_states, for drawing one phoneme at a time."""
+        keys = self.context_keys
+        for k in range(self.n, 0 if self.smoothing else self.n - 1, -1):
+            power = self.base ** (k - 1)
+            tag = context % power + power
+            idx = int(keys.searchsorted(tag))
+            if idx < len(keys) and keys[idx] == tag and not (self.partial and np.isnan(self.alphas[idx])):
+                return idx
+        return -1
+
+    def state_contexts(self, states):
+        """Return the n-gram order and packed context of each sampling state."""
+        tags = self.context_keys[states]
+        orders = np.searchsorted(self.powers, tags, side='right')
+        return orders, tags - self.powers[orders - 1]
+
+    def next_states(self, states, units):
+        """Sampling state reached from each state after emitting a (non-end) unit.
+
+        The longest seen suffix of a context extended by a unit only depends on
+        the state of the context, so states and units form a deterministic automaton."""
+        orders, contexts = self.state_contexts(states)
+        # A state of order k holds k-1 symbols, so the new suffix has at most k.
+        return self.sampling_states((contexts * self.base + units) % self.context_mod,
+                                    max_orders=np.minimum(orders + 1, self.n))
+
+    def state_distributions(self, states):
+        """Probability of every unit (in self.units order) in each sampling state."""
+        orders, contexts = self.state_contexts(states)
+        units = np.arange(1, len(self.units) + 1)
+        if not self.smoothing:
+            # Unsmoothed models only sample continuations seen at the top order.
+            found, idx = self._find_pairs(contexts[:, None] * self.base + units + self.powers[-1] * self.base)
+            return np.where(found & (orders == self.n)[:, None], self.pair_probs[idx], 0.0)
+        probs = np.empty((len(states), len(units)), dtype=np.float64)
+        for k in np.unique(orders).tolist():
+            rows = orders == k
+            probs[rows] = self.backoff_array(contexts[rows, None], units, order=k)
+        return probs
+
+    def sampling_table(self):
+        """Cumulative unit probabilities of every state, built once and cached."""
+        if self._cumprobs is None:
+            states = np.arange(len(self.context_keys))
+            cumprobs = np.empty((len(states), len(self.units)), dtype=np.float64)
+            for start in range(0, len(states), _TABLE_CHUNK):
+                rows = states[start:start + _TABLE_CHUNK]
+                cumprobs[rows] = np.cumsum(self.state_distributions(rows), axis=1)
+            self._cumprobs = cumprobs
+        return self._cumprobs
+
+    def distribution(self, context):
+        """Probability of every unit (in self.units order) after a packed context."""
+        state = int(self.sampling_states(context))
+        if state < 0:
+            return np.zeros(len(self.units))
+        return self.state_distributions(np.array([state]))[0]
+
+    def multichooser(self, context):
+        """ Return random choice (as a unit code) from the distribution after a packed context. """
+        state = self._sampling_state(context)
+        if state < 0:
+            return
+        cumprobs = self.sampling_table()[state]
+        idx = int(cumprobs.searchsorted(random.random(), side='right'))
+        if idx < len(cumprobs):
+            return idx + 1
+        return
+
+    def generate(self, ngen=1):
+        """Generate as many words as specified by ngen"""
+        return [self.generate_one(self.n) for xx in range(ngen)]
+
+    def generate_one(self, n):
+        """Generate one word from ngram model."""
+        context = 0
+        word = []
+        while True:
+            code = self.multichooser(context)
+            if code == self.end:
+                break
+            word.append(self.units[code - 1])
+            context = (context * self.base + code) % self.context_mod
+        return "".join(word)
+
+    def generate_batch(self, size, rng=None, max_length=None):
+        """Generate size words in lock-step, one vectorized draw per phoneme position.
+
+        Parameters
+        ----------
+        size: int
+           number of words to generate
+        rng: np.random.Generator or seed (default None)
+           source of randomness, passed to np.random.default_rng
+        max_length: int (default None)
+           drop words still unfinished after this many phonemes
+
+        Returns
+        -------
+        (list of str, np.ndarray)
+           the words and their log10 probabilities, as returned by evaluate
+        """
+        rng = np.random.default_rng(rng)
+        cumprobs = self.sampling_table()
+        contexts = np.zeros(size, dtype=np.int64)
+        log_probs = np.zeros(size, dtype=np.float64)
+        lengths = np.zeros(size, dtype=np.intp)
+        phones = np.zeros((size, 16), dtype=np.uint16)
+        active = np.arange(size)
+        while len(active) and (max_length is None or lengths[active[0]] <= max_length):
+            states = self.sampling_states(contexts[active])
+            rows = cumprobs[states]
+            # Index of the first cumulative probability above the draw, as in multichooser.
+            draws = (rows <= rng.random(len(active))[:, None]).sum(axis=1)
+            units = np.minimum(draws, len(self.units) - 1) + 1
+            log_probs[active] += log10_probs(self.backoff_array(contexts[active], units))
+            ended = units == self.end
+            active, units = active[~ended], units[~ended]
+            step = lengths[active[0]] if len(active) else 0
+            if step == phones.shape[1]:
+                phones = np.concatenate([phones, np.zeros_like(phones)], axis=1)
+            phones[active, step] = units
+            lengths[active] += 1
+            contexts[active] = (contexts[active] * self.base + units) % self.context_mod
+        done = np.ones(size, dtype=bool)
+        done[active] = False
+        return self.decode(phones[done], lengths[done]), log_probs[done]
+
+    def decode(self, phones, lengths):
+        """Turn rows of unit codes (0 = padding) and their lengths into strings."""
+        return _decode(self.units, phones, lengths)
+
+    def nbytes(self):
+        """Total size of the model arrays in bytes."""
+        return sum(a.nbytes for a in (self.context_keys, self.alphas, self.pair_keys, self.pair_probs))
+
+    def save(self, path):
+        """Write the model to directory path: one .npy file per array and a JSON header."""
+        os.makedirs(path, exist_ok=True)
+        for name in _ARRAYS:
+            np.save(os.path.join(path, name + ".npy"), getattr(self, name))
+        with open(os.path.join(path, "model.json"), "w") as f:
+            json.dump({'n': self.n, 'smoothing': self.smoothing, 'units': self.units, 'partial': self.partial}, f)
+
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        """Read a model written by save; arrays are memory-mapped unless mmap_mode is None."""
+        with open(os.path.join(path, "model.json")) as f:
+            header = json.load(f)
+        arrays = [np.load(os.path.join(path, name + ".npy"), mmap_mode=mmap_mode) for name in _ARRAYS]
+        return cls(header['n'], header['smoothing'], header['units'], *arrays, partial=header.get('partial', False))
+
+
+def _find(keys, queries):
+    """Look up queries in a sorted key table; return (found, index) arrays."""
+    if queries.size > _SORT_THRESHOLD:
+        # Searching in sorted order keeps the binary searches cache-friendly.
+        flat = queries.ravel()
+        order = np.argsort(flat)
+        idx = np.empty(flat.shape, dtype=np.intp)
+        idx[order] = np.searchsorted(keys, flat[order])
+        idx = idx.reshape(queries.shape)
+    else:
+        idx = np.searchsorted(keys, queries)
+    idx = np.where(idx == len(keys), 0, idx)
+    return keys[idx] == queries, idx
+
+
+def log10_probs(probs):
+    """math.log(p, 10) of every probability, so sums match evaluate() bit for bit."""
+    values, inverse = np.unique(probs, return_inverse=True)
+    return np.array([log(p, 10) for p in values.tolist()], dtype=np.float64)[inverse]
+
+
+def _decode(units, phones, lengths):
+    """Turn rows of unit codes (0 = padding) into strings."""
+    if not len(lengths):
+        return []
+    width = max(int(lengths.max()), 1)
+    chars = np.array([""] + list(units))[phones[:, :width]]
+    return chars.view("<U{w}".format(w=width)).ravel().tolist()
+
+
+def _pack(symbols, codes, base, oov=None):
+    """Pack a string of symbols into a single integer key."""
+    key = 0
+    for s in symbols:
+        key = key * base + (codes[s] if oov is None else codes.get(s, oov))
+    return key
+
+
+def compile_model(lm):
+    """Compile a trained NgramModel into a CompiledNgramModel."""
+    return CompiledNgramModel.from_model(lm)
@@ -18,6 +18,25 @@ MODEL_INFO = {'n': 4, 'smoothing': .01,
 
 ITERATIONS = 10 # number to generate
 
+# How artificial lexica are matched to the real length distribution:
+# 'conditioned' samples each length bucket directly, 'rejection' discards words from full buckets
+GENERATION_MODE = 'conditioned'
+
+SEED = None # base seed for the artificial lexica; None draws a fresh one (saved next to the output)
+PROCESSES = None # worker processes for generation and minimal pairs; None uses every core
+
+MODEL_CACHE_DIR = 'data/cache/models' # compiled models keyed on their training wordforms; None disables
+MODEL_CACHE_BYTES = 2 * 1024 ** 3 # least recently used models are evicted past this size
+
+CHUNK_SIZE = None # rows of the raw lexicon preprocessed at a time; None reads it whole
+
+INSTRUMENTATION_DIR = 'logs' # stage timings, counters and peak memory as JSON lines (see instrumentation.py); None disables
+PROFILE_STAGE = None # stage to profile, e.g. 'generate' or 'minimal_pairs'; None profiles nothing
+PROFILER = 'cprofile' # 'cprofile', or 'sample' for the lower-overhead sampling profiler
+
+# 'csv', or 'lexica' for columnar files partitioned by lexicon (see lexicon_store.py)
+OUTPUT_FORMAT = 'csv'
+
 # http://www.iub.edu/~psyling/papers/celex_eug.pdf
 # See pg. 179
 VOWEL_SETS = {'german': set("i#a$u3y)eo|o1246WBXIYE/{&AVOU@^cq0~"), 
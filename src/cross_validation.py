@@ -0,0 +1,175 @@
+"""Cross-validate phonotactic models of increasing order on held-out wordforms.
+
+For every split of a lexicon, the training wordforms are counted once, for the
+highest order; the models of lower orders are truncations of those counts
+(NgramCounts.truncate), identical to training them from scratch. Each model
+scores the whole held-out set in one evaluate_batch call, and the splits run in
+a pool of worker processes. The table has the columns of the "Evaluating
+phonotactic models" notebook: sum and mean held-out log-likelihood per split
+and order, and the test of each order against the order below it.
+
+As in the notebook, each language is read from LEXICON_PATH, the real lexicon
+with its minimal pairs, which the minimal pairs step has to write first;
+--lexicon-path reads another file instead, such as the preprocessed real lexicon.
+Languages whose file is missing are skipped. Run from the root of the repository:
+
+    python src/cross_validation.py --languages english german --orders 1 2 3 4 5 6
+    python src/cross_validation.py --lexicon-path "data/processed/{lan1}/reals/{lan2}_all_reals_5phone.csv"
+"""
+
+import argparse
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+from sklearn.model_selection import KFold, ShuffleSplit
+
+import config
+from ngram_counts import NgramCounts
+from parallel_generation import fork_pool, share, worker_state
+
+
+LEXICON_PATH = "data/processed/{lan1}/reals/{lan2}_with_mps_5phone.csv"
+ORDERS = range(1, 7)
+
+
+def splits(num_words, folds=None, test_size=.25, repetitions=10, seed=None):
+    """(train, test) index arrays of each split.
+
+    With folds, a shuffled k-fold partition (each word is held out once);
+    otherwise repetitions random splits holding out test_size of the words, as
+    train_test_split does in the notebook."""
+    if folds is not None:
+        return list(KFold(n_splits=folds, shuffle=True, random_state=seed).split(np.arange(num_words)))
+    return list(ShuffleSplit(n_splits=repetitions, test_size=test_size, random_state=seed).split(np.arange(num_words)))
+
+
+def likelihood_ratio(llmin, llmax):
+    return 2 * (llmax - llmin)
+
+
+def evaluate_split(train, test, orders=ORDERS, smoothing=.01):
+    """Held-out log-likelihoods of models of each order trained on train.
+
+    Returns
+    -------
+    list of dict
+       for each order n: 'n', 'mean_loglik', 'sum_loglik', and, against the
+       order below, 'likelihood_ratio' (of the summed log-likelihoods), 't' (of a
+       two-sample t-test on the per-word log-likelihoods) and the one-sided 'p'
+       of t > 0 (None for the first order)
+    """
+    orders = sorted(orders)
+    counts = NgramCounts(orders[-1]).update(train)
+    records = []
+    prev_probs = None
+    for n in orders:
+        test_probs = counts.truncate(n).compile(smoothing).evaluate_batch(test)[2]
+        record = {'n': n, 'mean_loglik': test_probs.mean(), 'sum_loglik': test_probs.sum(),
+                  'likelihood_ratio': None, 't': None, 'p': None}
+        if prev_probs is not None:
+            results = stats.ttest_ind(test_probs, prev_probs)
+            record['likelihood_ratio'] = likelihood_ratio(prev_probs.sum(), test_probs.sum())
+            record['t'] = results.statistic
+            # Directional test: we just want to know if t > 0
+            record['p'] = results.pvalue / 2 if results.statistic > 0 else 1
+        prev_probs = test_probs
+        records.append(record)
+    return records
+
+
+def _evaluate(job):
+    split, (train, test) = job
+    state = worker_state()
+    wordforms = state['wordforms']
+    records = evaluate_split(wordforms[train].tolist(), wordforms[test].tolist(), orders=state['orders'],
+                             smoothing=state['smoothing'])
+    for record in records:
+        record['split'] = split
+    return records
+
+
+def cross_validate(wordforms, orders=ORDERS, folds=None, test_size=.25, repetitions=10, smoothing=.01, seed=None,
+                   processes=None):
+    """Held-out log-likelihood of n-gram models of each order, over several splits.
+
+    Parameters
+    ----------
+    wordforms: list of str
+       lexicon to split
+    orders: iterable of int (default 1..6)
+       n-gram orders to compare
+    folds: int (default None)
+       number of folds of a k-fold partition; None uses random splits instead
+    test_size: float (default .25)
+       share of words held out by each random split
+    repetitions: int (default 10)
+       number of random splits
+    smoothing: float (default .01)
+       additive smoothing of the models
+    seed: int (default None)
+       seed of the splits
+    processes: int (default None)
+       number of worker processes; None uses every core, 1 runs in this process
+
+    Returns
+    -------
+    pd.DataFrame
+       one row per split and order, with the columns of evaluate_split and 'split'
+    """
+    wordforms = np.asarray(wordforms, dtype=object)
+    orders = sorted(orders)
+    jobs = list(enumerate(splits(len(wordforms), folds=folds, test_size=test_size, repetitions=repetitions,
+                                 seed=seed)))
+    # The wordforms and the evaluation settings are shared with the workers once.
+    state = {'wordforms': wordforms, 'orders': orders, 'smoothing': smoothing}
+    if processes == 1:
+        share(state)
+        results = [_evaluate(job) for job in jobs]
+    else:
+        with fork_pool(processes, state) as pool:
+            results = pool.map(_evaluate, jobs)
+    return pd.DataFrame([record for records in results for record in records],
+                        columns=['split', 'n', 'mean_loglik', 'sum_loglik', 'likelihood_ratio', 't', 'p'])
+
+
+def summarize(df_results):
+    """Mean of each statistic over splits, per language (if present) and order."""
+    keys = [k for k in ['language', 'n'] if k in df_results.columns]
+    columns = ['mean_loglik', 'sum_loglik', 'likelihood_ratio', 't', 'p']
+    return df_results.astype({c: float for c in columns}).groupby(keys)[columns].mean()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cross-validate n-gram models of each order on held-out wordforms.")
+    parser.add_argument('--languages', nargs='+', default=list(config.PHON_COLUMN))
+    parser.add_argument('--lexicon-path', default=LEXICON_PATH,
+                        help="lexicon of each language, formatted with lan1 and lan2 (default: %(default)s)")
+    parser.add_argument('--orders', nargs='+', type=int, default=list(ORDERS))
+    parser.add_argument('--folds', type=int, default=None, help="k-fold partition instead of random splits")
+    parser.add_argument('--repetitions', type=int, default=10)
+    parser.add_argument('--test-size', type=float, default=.25)
+    parser.add_argument('--seed', type=int, default=config.SEED)
+    parser.add_argument('--processes', type=int, default=config.PROCESSES)
+    parser.add_argument('--output', default="data/processed/cross_validation.csv")
+    args = parser.parse_args()
+
+    tables = []
+    for language in args.languages:
+        path = args.lexicon_path.format(lan1=language, lan2=language)
+        try:
+            df = pd.read_csv(path)
+        except OSError as error:
+            print("Skipping {lan}: {e}".format(lan=language, e=error))
+            continue
+        print("Cross-validating {lan}...".format(lan=language))
+        wordforms = df[config.PHON_COLUMN[language]].dropna().values
+        df_results = cross_validate(wordforms, orders=args.orders, folds=args.folds, test_size=args.test_size,
+                                    repetitions=args.repetitions, seed=args.seed, processes=args.processes)
+        df_results.insert(0, 'language', language)
+        tables.append(df_results)
+    if not tables:
+        parser.error("no lexicon found for {langs} (see --lexicon-path)".format(langs=", ".join(args.languages)))
+    df_results = pd.concat(tables, ignore_index=True)
+    df_results.to_csv(args.output, index=False)
+    print(summarize(df_results))
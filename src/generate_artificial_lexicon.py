@@ -1,125 +1,158 @@
 """Generate artificial lexicon."""
 
 import os
+from collections import Counter
+import numpy as np
 import pandas as pd 
-from tqdm import tqdm
 
-from utils import count_syllables
+from utils import count_syllables_batch
 import config 
-from preprocess import preprocess_lexicon
+from preprocess import preprocess_lexicon, preprocess_lexicon_chunks
+from raw_lexicon import read_raw_lexicon, remap_transcription, remove_stress
+from compiled_model import compile_model
+from model_cache import ModelCache
+from length_sampler import LengthConditionedSampler
+from parallel_generation import iter_lexica, lexicon_seeds, save_seeds
+from lexicon_store import open_artificials_writer
+import instrumentation
 
 
 
 
 # match original distribution (including homophones) or distribution of unique lemma lengths?
-def build_lexicon(lm, language, length_dist, vowels, original_lexicon, match_on='phones', lex_num=1):
+def build_lexicon(lm, language, length_dist, vowels, original_lexicon, match_on='phones', lex_num=1, batch_size=10000,
+                  rng=None):
     """Build a lexicon matching the distribution of lengths in length_dist.
 
     Parameters
     ----------
-    lm: NGram
+    lm: CompiledNgramModel
        n-gram model to evaluate/generate plausible wordforms
     length_dist: dict
        dictionary with info about number of words of each length
     lex_num: int (default 1)
         which lexicon is being built
+    batch_size: int (default 10000)
+        number of candidate words generated per call to lm.generate_batch
+    rng: np.random.Generator (default None)
+        source of randomness for generation
     """
     artificial_lengths = length_dist.copy()
     new_words = []
+    # Candidates examined per length bucket; all but length_dist of them were rejected
+    generated = Counter()
     while True:
-        w = lm.generate()[0]
-        num_phones = len(w)
-        num_sylls = count_syllables(w, language=language, vowels=vowels)
-        word_length = num_phones if match_on == "phones" else num_sylls
-        if artificial_lengths[word_length] > 0:
-            if any((v in vowels) for v in w):
-                artificial_lengths[word_length] -= 1
-                prob = lm.evaluate(w)[2]
-                new_words.append({
-                    'word': w,
-                    'num_phones': num_phones,
-                    'prob': prob,
-                    'num_sylls_est': num_sylls,
-                    'surprisal': -prob,
-                    'lexicon': lex_num})
-        elif sum(artificial_lengths.values()) == 0: # 50000:
-            return pd.DataFrame(new_words)
-
-
-def remove_stress(wordform):
-    """Remove stress markers to create unstressed version."""
-    print(wordform)
-    return wordform.replace("'", "").replace("-", "")
-
-def remap_transcription(wordform):
-    """Remap any phonemes represented by double characters to single characters."""
-    mappings = config.PHONETIC_REMAPPINGS[config.LANGUAGE]
-    for og, new in mappings.items():
-        wordform = wordform.replace(og, new)
-    return wordform
-
-### Set up directories
-if not os.path.exists("data/processed/{lan}".format(lan=config.LANGUAGE)):
-    print("Creating directory: data/processed/{lan}".format(lan=config.LANGUAGE))
-    os.mkdir("data/processed/{lan}".format(lan=config.LANGUAGE))
-
-
-### Read in dataframe
-path, sep = config.LEXICON_PATHS[config.LANGUAGE]
-df = pd.read_csv(path, sep=sep)
-
-
-### Extract params
-PHON_COLUMN = config.PHON_COLUMN[config.LANGUAGE]
-WORD_COLUMN = config.WORD_COLUMN[config.LANGUAGE]
-
-
-if config.LANGUAGE in ['english', 'german']:
-    info_for_generation = preprocess_lexicon(df, language=config.LANGUAGE, phon_column=PHON_COLUMN, word_column=WORD_COLUMN, vowels=config.VOWEL_SETS[config.LANGUAGE],
-                                             **config.MODEL_INFO)
-elif config.LANGUAGE in ['dutch']:
-    df = df.dropna()
-    df['PhonDISC'] = df['PhonStrsDISC'].apply(lambda x: remove_stress(x))
-    info_for_generation = preprocess_lexicon(df, language=config.LANGUAGE, phon_column=PHON_COLUMN, word_column=WORD_COLUMN, vowels=config.VOWEL_SETS[config.LANGUAGE],
-                                             **config.MODEL_INFO)
-elif config.LANGUAGE in ['french']:
-    # Keep only lemmas
-    df = df[df['14_islem']==1]
-    print(len(df))
-    info_for_generation = preprocess_lexicon(df, language=config.LANGUAGE, phon_column=PHON_COLUMN, word_column=WORD_COLUMN, vowels=config.VOWEL_SETS[config.LANGUAGE],
-                                             **config.MODEL_INFO)
-elif config.LANGUAGE in ['japanese']:
-    # Remove proper names
-    df = df[df['morph_form']!="prop"]
-    print(len(df))
-    # Remove words with >1 pronunciation
-    df['multiple_pronunications'] = df['phonetic_form'].apply(lambda x: "/" in x)
-    df = df[df['multiple_pronunications']==False]
-    print(len(df))
-    # Now remap phonetic transcription so there's only one character per phoneme
-    df['phonetic_remapped'] = df['phonetic_form'].apply(lambda x: remap_transcription(x))
-    # Now process the data for the homophone analysis and artificial lexicon generation
-    info_for_generation = preprocess_lexicon(df, language=config.LANGUAGE, phon_column=PHON_COLUMN, word_column=WORD_COLUMN, vowels=config.VOWEL_SETS[config.LANGUAGE],
-                                             **config.MODEL_INFO)
-
-elif config.LANGUAGE in ['mandarin']:
-    # TODO: Homophones are already condensed in "homodensity". So maybe we need to "duplicate" an entry for each value in HomoDensity
-    # Or maybe that should already be done before it gets to this point...
-    info_for_generation = preprocess_lexicon(df, language=config.LANGUAGE, phon_column=PHON_COLUMN, word_column=WORD_COLUMN, vowels=config.VOWEL_SETS[config.LANGUAGE],
-                                             **config.MODEL_INFO)
-
-artificial_lexicons = []
-for lex in tqdm(range(config.ITERATIONS)):
-    new_lex = build_lexicon(lm=info_for_generation['model'], language=config.LANGUAGE, length_dist=info_for_generation['original_counts'], 
-                            vowels=config.VOWEL_SETS[config.LANGUAGE], 
-                            original_lexicon=info_for_generation['original_lexicon'],
-                            match_on=config.MODEL_INFO['match_on'], lex_num=lex)
-    artificial_lexicons.append(new_lex)
-
-
-df_artificial_lexicons = pd.concat(artificial_lexicons)
-df_artificial_lexicons.to_csv("data/processed/{lang1}/{lang2}_artificial_{num}_matched_on_{match}_no_restriction_{n}phone.csv".format(
-    lang1=config.LANGUAGE, lang2=config.LANGUAGE, num=str(config.ITERATIONS), match=config.MODEL_INFO['match_on'], n=config.MODEL_INFO['n']))
-
-
+        words, probs = lm.generate_batch(batch_size, rng=rng)
+        sylls = count_syllables_batch(words, language=language, vowels=vowels)
+        for w, prob, num_sylls in zip(words, probs.tolist(), sylls.tolist()):
+            num_phones = len(w)
+            word_length = num_phones if match_on == "phones" else num_sylls
+            generated[word_length] += 1
+            if artificial_lengths[word_length] > 0:
+                if any((v in vowels) for v in w):
+                    artificial_lengths[word_length] -= 1
+                    new_words.append({
+                        'word': w,
+                        'num_phones': num_phones,
+                        'prob': prob,
+                        'num_sylls_est': num_sylls,
+                        'surprisal': -prob,
+                        'lexicon': lex_num})
+            elif sum(artificial_lengths.values()) == 0: # 50000:
+                instrumentation.record('build_lexicon', lexicon=lex_num, generated=sum(generated.values()),
+                                       rejected=sum(generated.values()) - len(new_words),
+                                       by_length={length: {'generated': count, 'rejected': count - length_dist.get(length, 0)}
+                                                  for length, count in sorted(generated.items())})
+                return pd.DataFrame(new_words)
+
+
+def build_lexicon_by_length(sampler, language, length_dist, vowels, match_on='phones', lex_num=1, rng=None):
+    """Build a lexicon matching the distribution of lengths in length_dist, without rejection.
+
+    Each length bucket is filled directly with words sampled conditional on that length,
+    which gives the same distribution of words as build_lexicon.
 
+    Parameters
+    ----------
+    sampler: LengthConditionedSampler
+       length-conditioned sampler over the n-gram model
+    length_dist: dict
+       dictionary with info about number of words of each length
+    lex_num: int (default 1)
+        which lexicon is being built
+    rng: np.random.Generator (default None)
+        source of randomness for generation
+    """
+    rng = np.random.default_rng(rng)
+    new_words = []
+    for word_length, count in sorted(length_dist.items()):
+        if count <= 0:
+            continue
+        words, probs = sampler.sample(word_length, count, rng=rng)
+        sylls = count_syllables_batch(words, language=language, vowels=vowels)
+        for w, prob, num_sylls in zip(words, probs.tolist(), sylls.tolist()):
+            new_words.append({
+                'word': w,
+                'num_phones': len(w),
+                'prob': prob,
+                'num_sylls_est': num_sylls,
+                'surprisal': -prob,
+                'lexicon': lex_num})
+    return pd.DataFrame(new_words)
+
+
+if __name__ == "__main__":
+    ### Set up directories
+    if not os.path.exists("data/processed/{lan}".format(lan=config.LANGUAGE)):
+        print("Creating directory: data/processed/{lan}".format(lan=config.LANGUAGE))
+        os.mkdir("data/processed/{lan}".format(lan=config.LANGUAGE))
+
+
+    ### Extract params
+    PHON_COLUMN = config.PHON_COLUMN[config.LANGUAGE]
+    WORD_COLUMN = config.WORD_COLUMN[config.LANGUAGE]
+
+    # Stage timings and counters of this run go to config.INSTRUMENTATION_DIR
+    instrumentation.configure('generate_{lan}'.format(lan=config.LANGUAGE), config.INSTRUMENTATION_DIR,
+                              profile_stage=config.PROFILE_STAGE, profiler=config.PROFILER)
+
+    # Trained models are reused across runs on an unchanged lexicon
+    cache = ModelCache(config.MODEL_CACHE_DIR, config.MODEL_CACHE_BYTES) if config.MODEL_CACHE_DIR else None
+
+    ### Read in dataframe, filtered and remapped for the language
+    with instrumentation.stage('load'):
+        lexicon = read_raw_lexicon(config.LANGUAGE, chunksize=config.CHUNK_SIZE)
+    preprocess = preprocess_lexicon if config.CHUNK_SIZE is None else preprocess_lexicon_chunks
+    with instrumentation.stage('preprocess'):
+        info_for_generation = preprocess(lexicon, language=config.LANGUAGE, phon_column=PHON_COLUMN, word_column=WORD_COLUMN,
+                                         vowels=config.VOWEL_SETS[config.LANGUAGE], cache=cache, **config.MODEL_INFO)
+
+
+    # Generate from the compiled model, which draws whole batches of candidates at once
+    model = info_for_generation['model']
+    if cache is None:
+        model = compile_model(model)
+    build_args = {'language': config.LANGUAGE, 'length_dist': info_for_generation['original_counts'],
+                  'vowels': config.VOWEL_SETS[config.LANGUAGE], 'match_on': config.MODEL_INFO['match_on']}
+    if config.GENERATION_MODE == 'conditioned':
+        build = build_lexicon_by_length
+        build_args['sampler'] = LengthConditionedSampler(model, vowels=config.VOWEL_SETS[config.LANGUAGE], language=config.LANGUAGE,
+                                                         match_on=config.MODEL_INFO['match_on'],
+                                                         max_length=max(info_for_generation['original_counts']))
+    else:
+        build = build_lexicon
+        build_args.update({'lm': model, 'original_lexicon': info_for_generation['original_lexicon']})
+        # Built here, before the workers fork, so they share one copy of the table instead of each building its own
+        model.sampling_table()
+
+    output_path = "data/processed/{lang1}/{lang2}_artificial_{num}_matched_on_{match}_no_restriction_{n}phone.csv".format(
+        lang1=config.LANGUAGE, lang2=config.LANGUAGE, num=str(config.ITERATIONS), match=config.MODEL_INFO['match_on'], n=config.MODEL_INFO['n'])
+
+    # Lexicon k is seeded from config.SEED and k only, so it does not depend on config.PROCESSES.
+    # Each lexicon is written as soon as it is built, so they are never all held in memory.
+    seeds = lexicon_seeds(config.SEED, config.ITERATIONS)
+    with open_artificials_writer(output_path, config.OUTPUT_FORMAT) as writer:
+        for lex_num, df_lexicon in enumerate(iter_lexica(build, seeds, processes=config.PROCESSES, **build_args)):
+            with instrumentation.stage('write', lexicon=lex_num, rows=len(df_lexicon)):
+                writer.append(df_lexicon)
+    save_seeds(seeds, output_path.replace(".csv", "_seeds.json"))
@@ -2,24 +2,20 @@
 
 Directly taken from Dautriche et al (2017): https://github.com/SbllDtrch/NullLexicons"""
 
-from nltk import *
-from math import log, sqrt, exp 
-import nltk
-import random, sys, re
-import time, datetime
+from math import log
+import bisect
 import collections
-import itertools 
+import random
 
-
-from nltk import *
-import random, sys, re, os
-import nltk
-import argparse
-import itertools
-import time, datetime
-import pickle
-t = time.time()
-import collections
+# The notebooks import this module as src.generative_model; the scripts run with src/ on the path.
+try:
+    from .ngram_counts import NgramCounts
+    from .compiled_model import compile_model
+    from .backoff_cache import BackoffCache
+except ImportError:
+    from ngram_counts import NgramCounts
+    from compiled_model import compile_model
+    from backoff_cache import BackoffCache
 
 
 class LM:
@@ -62,49 +58,84 @@ class NgramModel(LM):
         self.units = []
         self.generation = gen
         self.alpha = collections.defaultdict(lambda: collections.defaultdict(int))
+        self.samplers = {}
+        self.backoff_cache = None
+        self.compiled = None
         LM.__init__(self)
 
     def create_model(self, corpus, smoothing = 0):
-        """Update cfd using ngrams"""
-        import time
-        unigrams = []
-        for item in corpus:
-            for k in range(1,self.n+1):
-                item_ngrams = nltk.ngrams(["["]*(k-1)  + [i for i in item] + ["]"], k)
-                for ng in item_ngrams:
-                    self.cfd[k]["".join(ng[:-1])][ng[-1]] += 1.0 #* float(f)
-                    unigrams += [ng[-1]]
-        U = len(set(unigrams))
-        # Create set of unique phonemes
-        self.units = list(set(unigrams))
+        """Count all n-gram orders of corpus in one pass and normalize them."""
+        self.counts = NgramCounts(self.n).update(corpus)
         self.smoothing = smoothing
-        for k in self.cfd.keys():
-            for i in self.cfd[k].keys():
-                pbak = 0
-                for j in self.cfd[k][i].keys():
-                    self.cpd[k][i][j] = (self.cfd[k][i][j] + smoothing) / float(sum(self.cfd[k][i].values()) + smoothing*U)
-                    pbak += self.cpd[k-1][i[1:]][j]
-                if self.smoothing:
-                    self.alpha[k][i] = (1 - sum(self.cpd[k][i].values())) / float(1 - pbak) 
+        self.load_counts()
         LM.create_model(self, corpus, smoothing)
 
-    def multichooser(self, context):
-        """ Return random choice from multinomial cfd. """
-        context = "".join(context)
-        cumprob = 0
-        rand = random.random()
-        pd  = collections.defaultdict(int)
+    def update(self, new_wordforms):
+        """Add wordforms to the training data without recounting the old ones."""
+        self.counts.update(new_wordforms)
+        self.load_counts()
+
+    def load_counts(self):
+        """Fill cfd, cpd and alpha from self.counts, in order of first occurrence."""
+        self.cfd = collections.defaultdict(lambda: collections.defaultdict(lambda: collections.defaultdict(int)))
+        self.cpd  = collections.defaultdict(lambda: collections.defaultdict(lambda: collections.defaultdict(int)))
+        self.alpha = collections.defaultdict(lambda: collections.defaultdict(int))
+        symbols = self.counts.symbols
+        self.units = self.counts.units
+        orders = self.counts.normalize(self.smoothing)
+        for k, (ngrams, probs, context_index, contexts, alphas) in enumerate(orders, 1):
+            contexts = ["".join(symbols[c] for c in h) for h in contexts.tolist()]
+            cfd, cpd = self.cfd[k], self.cpd[k]
+            for ng, h, count, p in zip(ngrams[:, -1].tolist(), context_index.tolist(),
+                                       self.counts.counts[k - 1].tolist(), probs.tolist()):
+                cfd[contexts[h]][symbols[ng]] = float(count)
+                cpd[contexts[h]][symbols[ng]] = p
+            if alphas is not None:
+                self.alpha[k].update(zip(contexts, alphas.tolist()))
+        self.samplers = {}
+        self.compiled = None
+        if self.backoff_cache is not None:
+            self.cache_backoff(self.backoff_cache.max_size, self.backoff_precomputed)
+
+    def sampling_state(self, context):
+        """ Return the (order, context) whose distribution is used after context.
+
+        With smoothing, every context backs off to the same distribution as its
+        longest suffix seen in training, so samplers are shared between them."""
+        if not self.smoothing:
+            return self.n, context
+        for k in range(self.n, 0, -1):
+            h = context[len(context) - (k - 1):]
+            if h in self.cfd[k]:
+                return k, h
+
+    def sampling_table(self, k, h):
+        """ Return sorted possible units and their cumulative probabilities after h. """
         if self.smoothing:
-            for u in self.units:
-                pd[u] = self.backoff(self.n, context, u)
-            possibles = list(self.units)
+            possibles = sorted(self.units)
+            pd = dict((u, self.backoff(k, h, u)) for u in possibles)
         else:
-            possibles = self.cpd[self.n][context].keys()
-            pd = self.cpd[self.n][context]
-        possibles.sort()
+            pd = self.cpd[k].get(h, {})
+            possibles = sorted(pd.keys())
+        cumprobs = []
+        cumprob = 0
         for possible in possibles:
             cumprob += pd[possible]
-            if cumprob > rand: return possible
+            cumprobs.append(cumprob)
+        return possibles, cumprobs
+
+    def multichooser(self, context):
+        """ Return random choice from multinomial cfd.
+
+        Sampling tables are built once per state and cached in self.samplers, so
+        each draw is a binary search over the cumulative probabilities."""
+        context = "".join(context)
+        state = self.sampling_state(context)
+        if state not in self.samplers:
+            self.samplers[state] = self.sampling_table(*state)
+        possibles, cumprobs = self.samplers[state]
+        i = bisect.bisect_right(cumprobs, random.random())
+        if i < len(possibles): return possibles[i]
         return
 	    
     def generate(self, ngen = 1):
@@ -145,7 +176,45 @@ class NgramModel(LM):
             fifo.append(ch)
         return len(word), oov, p
 
+    def evaluate_batch(self, wordforms):
+        """ evaluate many words at once through the compiled model; see CompiledNgramModel.evaluate_batch """
+        return self.compile().evaluate_batch(wordforms)
+
+    def compile(self):
+        """ Compiled version of the model, built once and rebuilt when the model is (re)trained. """
+        if self.compiled is None:
+            self.compiled = compile_model(self)
+        return self.compiled
+
+    def cache_backoff(self, max_size=None, precompute=False):
+        """ Memoize backoff(n, h, c) in self.backoff_cache.
+
+        max_size bounds the cache, dropping the least recently used entries; None
+        keeps everything. precompute fills it up front with every unit after every
+        seen context of every order, computed in one vectorized pass. The cache is
+        rebuilt with the same settings whenever the model is (re)trained."""
+        self.backoff_cache = BackoffCache(max_size)
+        self.backoff_precomputed = precompute
+        if precompute:
+            lm = self.compile()
+            for k in range(1, self.n + 1):
+                contexts = list(self.cfd[k].keys())
+                table = lm.backoff_table(k, contexts).tolist()
+                self.backoff_cache.update(((k, h, c), p) for h, row in zip(contexts, table)
+                                          for c, p in zip(lm.units, row))
+        return self.backoff_cache
+
     def backoff(self, n, h, c):
+        cache = self.backoff_cache
+        if cache is None:
+            return self._backoff(n, h, c)
+        p = cache.get((n, h, c))
+        if p is None:
+            p = self._backoff(n, h, c)
+            cache.put((n, h, c), p)
+        return p
+
+    def _backoff(self, n, h, c):
         if c in self.cpd[n][h].keys() and n > 0:#seen ngram
             return self.cpd[n][h][c]
         elif h not in self.alpha[n].keys() and n > 0:#context never been observed
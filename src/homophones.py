@@ -0,0 +1,67 @@
+"""Homophone counts of a lexicon from a single factorization of its wordforms.
+
+HomophoneIndex hashes a column of wordforms once into integer codes, one per
+row, pointing into the distinct forms in order of first occurrence. Homophone
+counts, the set of unique forms, the first row of each form and any per-form
+result mapped back onto rows are then array operations on those codes, so a
+lexicon is not regrouped or rehashed by each stage that needs one of them."""
+
+import numpy as np
+import pandas as pd
+
+
+class HomophoneIndex:
+    """Distinct wordforms of a column, the form of each row, and how often each occurs.
+
+    Parameters
+    ----------
+    codes: np.ndarray
+       for each row, the position of its wordform in forms (-1 for a missing value)
+    forms: np.ndarray
+       distinct wordforms, in order of first occurrence
+    """
+
+    def __init__(self, codes, forms):
+        self.codes = np.asarray(codes, dtype=np.int64)
+        self.forms = np.asarray(forms, dtype=object)
+        self.counts = np.bincount(self.codes[self.codes >= 0], minlength=len(self.forms))
+
+    @classmethod
+    def from_values(cls, values):
+        """Factorize a Series (or any sequence) of wordforms."""
+        codes, forms = pd.factorize(values, use_na_sentinel=True)
+        return cls(codes, forms)
+
+    def __len__(self):
+        return len(self.forms)
+
+    def homophone_counts(self):
+        """Series mapping each distinct form to its number of homophones (occurrences - 1)."""
+        return pd.Series(self.counts - 1, index=pd.Index(self.forms))
+
+    def num_homophones(self):
+        """Number of homophones of each row's wordform (NaN for a missing one)."""
+        return self.take(self.counts - 1)
+
+    def first_rows(self):
+        """Mask of the first row of each wordform, like ~Series.duplicated() without missing values."""
+        mask = np.zeros(len(self.codes), dtype=bool)
+        _, first = np.unique(self.codes, return_index=True)
+        mask[first] = True
+        mask[self.codes < 0] = False
+        return mask
+
+    def take(self, per_form):
+        """Values given for each distinct form (in the order of forms), spread onto rows."""
+        per_form = np.asarray(per_form)
+        if len(per_form) == 0:
+            return np.full(len(self.codes), np.nan)
+        values = per_form[self.codes]
+        if (self.codes < 0).any():
+            values = values.astype(np.float64)
+            values[self.codes < 0] = np.nan
+        return values
+
+    def take_dict(self, mapping, default=0):
+        """mapping[form] (or default) for each row's wordform."""
+        return self.take(np.array([mapping.get(form, default) for form in self.forms.tolist()]))
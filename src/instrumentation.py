@@ -0,0 +1,160 @@
+"""Stage timers, counters and peak memory of pipeline runs, as JSON lines in logs/.
+
+A script calls configure once; afterwards stage() times a block of work and
+record() writes any other event (e.g. counters). Every line carries the run id,
+the process id and the peak resident set size so far, and is appended to the
+run's file by whichever process emits it, so forked workers report into the
+same log. Until configure is called, stage() and record() do nothing but time.
+
+One stage can be profiled by naming it in configure: with 'cprofile' its
+cProfile stats are dumped next to the log (.prof, readable with pstats or
+snakeviz); with 'sample' the main thread's stack is sampled on a CPU-time timer
+and written as collapsed stacks (.stacks, the input of flamegraph.pl)."""
+
+import collections
+import contextlib
+import itertools
+import json
+import os
+import signal
+import sys
+import time
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+
+# Set by configure: where events go and which stage to profile.
+_RUN = {'path': None, 'run': None, 'profile_stage': None, 'profiler': 'cprofile', 'interval': .005}
+# Numbers the profiles of a process, since a stage may run more than once (e.g. once per lexicon).
+_PROFILES = itertools.count()
+
+
+def configure(name, directory='logs', profile_stage=None, profiler='cprofile', interval=.005):
+    """Start logging events of this run to directory/<name>_<time>.jsonl; returns the path.
+
+    Parameters
+    ----------
+    name: str
+       name of the script, e.g. 'generate'
+    directory: str (default 'logs')
+       where logs are written; None disables instrumentation
+    profile_stage: str (default None)
+       name of a stage to profile
+    profiler: str (default 'cprofile')
+       'cprofile' (deterministic) or 'sample' (statistical, lower overhead)
+    interval: float (default .005)
+       seconds of CPU time between stack samples of the 'sample' profiler
+    """
+    if directory is None:
+        _RUN['path'] = None
+        return None
+    os.makedirs(directory, exist_ok=True)
+    run = "{name}_{t}".format(name=name, t=time.strftime("%Y%m%d-%H%M%S"))
+    _RUN.update({'path': os.path.join(directory, run + ".jsonl"), 'run': run, 'profile_stage': profile_stage,
+                 'profiler': profiler, 'interval': interval})
+    record('start', argv=sys.argv)
+    return _RUN['path']
+
+
+def peak_rss():
+    """Peak resident set size in bytes of this process and of its finished children (None if unknown)."""
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+    unit = 1 if sys.platform == 'darwin' else 1024
+    return {'self': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * unit,
+            'children': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * unit}
+
+
+def record(event, **fields):
+    """Append one event to the run's log."""
+    if _RUN['path'] is None:
+        return
+    line = {'time': time.time(), 'run': _RUN['run'], 'pid': os.getpid(), 'event': event}
+    line.update(fields)
+    line['peak_rss'] = peak_rss()
+    # One write per line in append mode, so lines from several processes do not interleave.
+    with open(_RUN['path'], "a") as f:
+        f.write(json.dumps(line, default=_plain) + "\n")
+
+
+@contextlib.contextmanager
+def stage(name, **fields):
+    """Time the enclosed block as stage name (profiling it if configured to)."""
+    profile = _RUN['path'] is not None and name == _RUN['profile_stage']
+    profiler = _start_profiler() if profile else None
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException as error:
+        fields['error'] = repr(error)
+        raise
+    finally:
+        seconds = time.perf_counter() - start
+        if profiler is not None:
+            fields['profile'] = _stop_profiler(profiler, name)
+        record('stage', stage=name, seconds=seconds, **fields)
+
+
+def _start_profiler():
+    if _RUN['profiler'] == 'sample':
+        return _StackSampler(_RUN['interval']).start()
+    import cProfile
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return profiler
+
+
+def _stop_profiler(profiler, name):
+    """Stop profiling and save the profile; returns its path."""
+    path = "{base}_{stage}_{pid}_{k}".format(base=_RUN['path'][:-len(".jsonl")], stage=name, pid=os.getpid(),
+                                             k=next(_PROFILES))
+    if isinstance(profiler, _StackSampler):
+        profiler.stop()
+        path += ".stacks"
+        profiler.dump(path)
+    else:
+        profiler.disable()
+        path += ".prof"
+        profiler.dump_stats(path)
+    return path
+
+
+class _StackSampler:
+    """Statistical profiler: counts the main thread's call stacks on a CPU-time timer."""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.stacks = collections.Counter()
+
+    def start(self):
+        self.previous = signal.signal(signal.SIGPROF, self._sample)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+        return self
+
+    def stop(self):
+        signal.setitimer(signal.ITIMER_PROF, 0, 0)
+        signal.signal(signal.SIGPROF, self.previous)
+
+    def _sample(self, signum, frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append("{f} ({file}:{line})".format(f=code.co_name, file=os.path.basename(code.co_filename),
+                                                     line=code.co_firstlineno))
+            frame = frame.f_back
+        self.stacks[";".join(reversed(stack))] += 1
+
+    def dump(self, path):
+        with open(path, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write("{s} {c}\n".format(s=stack, c=count))
+
+
+def _plain(value):
+    """JSON form of NumPy scalars and other values json does not know."""
+    return value.item() if hasattr(value, "item") else str(value)
@@ -0,0 +1,164 @@
+"""Sample words from a compiled n-gram model conditioned on their length.
+
+Rather than generating unconstrained words and rejecting those whose length
+bucket is full, LengthConditionedSampler precomputes, for every sampling state,
+the probability of finishing a word in exactly r more phones (or syllables), and
+draws each phoneme from the model distribution reweighted by those probabilities.
+Words are therefore distributed exactly as accepted words are under rejection
+sampling: P(word | length, word has a vowel)."""
+
+import numpy as np
+from scipy import sparse
+
+from compiled_model import _TABLE_CHUNK, log10_probs
+
+
+class LengthConditionedSampler:
+    """Backward probabilities over (state, remaining length, vowel still needed).
+
+    Memory grows with the number of sampling states times the number of units.
+    The next-phoneme probabilities, state transitions and length increments are
+    dense tables of every state by every unit, at 8 + 4 + 1 bytes per cell. The
+    sparse transition matrices built from them hold up to as much again. For a
+    German 5-phone model (74k states, 62 units), the tables take 73 MB and
+    construction peaks near 255 MB. The probabilities stay float64, so sampled
+    words get exactly the log probabilities of evaluate.
+
+    Parameters
+    ----------
+    lm: CompiledNgramModel
+       n-gram model to generate from
+    vowels: str or set
+       vowel symbols of the language
+    language: str
+       language of the lexicon (Japanese geminates count as syllables)
+    match_on: str (default 'phones')
+       condition on number of 'phones' or 'sylls' (as in utils.count_syllables)
+    max_length: int (default 20)
+       longest length (in match_on units) that can be requested
+    tolerance: float (default 1e-13)
+       convergence threshold of the fixed point used when matching on syllables
+    max_iterations: int (default 1000)
+       cap on the fixed-point iterations per syllable count
+    """
+
+    def __init__(self, lm, vowels, language, match_on='phones', max_length=20, tolerance=1e-13,
+                 max_iterations=1000):
+        self.lm = lm
+        self.match_on = match_on
+        geminates = match_on == 'sylls' and language in ['japanese']
+        if geminates and lm.n < 2:
+            raise ValueError("Counting geminates requires a model with n >= 2.")
+        num_states, num_units = len(lm.context_keys), len(lm.units)
+        states = np.arange(num_states)
+        units = np.arange(1, num_units + 1)
+        end = lm.end - 1
+
+        self.probs = np.empty((num_states, num_units), dtype=np.float64)
+        self.transitions = np.empty((num_states, num_units), dtype=np.int32)
+        for start in range(0, num_states, _TABLE_CHUNK):
+            rows = states[start:start + _TABLE_CHUNK]
+            self.probs[rows] = lm.state_distributions(rows)
+            self.transitions[rows] = lm.next_states(rows[:, None], units)
+        # The end symbol leads nowhere; point it at a valid row, it is always masked.
+        self.transitions[:, end] = 0
+        self.transitions[self.transitions < 0] = 0
+        self.start = int(lm.sampling_states(0))
+
+        self.vowel = np.array([u in vowels for u in lm.units])
+        self.vowel[end] = False
+        if match_on == 'phones':
+            self.increments = np.ones((num_states, num_units), dtype=np.int8)
+        else:
+            orders, contexts = lm.state_contexts(states)
+            last = np.where(orders > 1, contexts % lm.base, -1)
+            self.increments = np.repeat(self.vowel[None, :], num_states, axis=0).astype(np.int8)
+            if geminates:
+                self.increments |= units[None, :] == last[:, None]
+        self.increments[:, end] = 0
+        self.end = end
+
+        # finish[r, v, s]: probability of ending a word from state s after exactly r more
+        # length units, where v == 1 means no vowel has been produced yet.
+        self.finish = np.zeros((max_length + 1, 2, num_states), dtype=np.float64)
+        advance = self._transition_matrices(self.increments == 1)
+        stay = self._transition_matrices(self.increments == 0)
+        for r in range(max_length + 1):
+            fixed = np.zeros((2, num_states))
+            fixed[0] = self.probs[:, end] if r == 0 else 0
+            if r > 0:
+                fixed += self._propagate(advance, self.finish[r - 1])
+            current = fixed
+            if match_on == 'sylls':
+                # Phones that do not add a syllable keep r fixed: iterate to the fixed point.
+                for _ in range(max_iterations):
+                    updated = fixed + self._propagate(stay, current)
+                    converged = np.abs(updated - current).max() <= tolerance * max(updated.max(), 1e-300)
+                    current = updated
+                    if converged:
+                        break
+            self.finish[r] = current
+
+    def _transition_matrices(self, steps):
+        """Sparse state-to-state matrices of the (non-end) steps where steps is True.
+
+        One matrix for all units, one for vowels and one for consonants."""
+        num_states = len(steps)
+        steps = steps & (self.probs != 0)
+        steps[:, self.end] = False
+        matrices = []
+        for mask in (np.ones_like(self.vowel), self.vowel, ~self.vowel):
+            rows, cols = np.nonzero(steps & mask)
+            matrices.append(sparse.csr_matrix((self.probs[rows, cols], (rows, self.transitions[rows, cols])),
+                                              shape=(num_states, num_states)))
+        return matrices
+
+    def _propagate(self, matrices, finish):
+        """Expected finishing probability of the next state, for both vowel flags."""
+        total, vowel, consonant = matrices
+        return np.stack([total @ finish[0], vowel @ finish[0] + consonant @ finish[1]])
+
+    def probability(self, length):
+        """Probability that an unconstrained word has this length and contains a vowel."""
+        return float(self.finish[length, 1, self.start])
+
+    def sample(self, length, size, rng=None):
+        """Generate size words of the given length.
+
+        Returns
+        -------
+        (list of str, np.ndarray)
+           the words and their log10 probabilities under the unconditioned model
+        """
+        if self.probability(length) <= 0:
+            raise ValueError("The model cannot generate words of length {l}.".format(l=length))
+        rng = np.random.default_rng(rng)
+        states = np.full(size, self.start, dtype=np.intp)
+        remaining = np.full(size, length, dtype=np.intp)
+        need_vowel = np.ones(size, dtype=np.intp)
+        log_probs = np.zeros(size, dtype=np.float64)
+        lengths = np.zeros(size, dtype=np.intp)
+        phones = np.zeros((size, 16), dtype=np.uint16)
+        active = np.arange(size)
+        while len(active):
+            s, r, v = states[active], remaining[active], need_vowel[active]
+            next_remaining = r[:, None] - self.increments[s]
+            next_need = v[:, None] & ~self.vowel
+            finish = self.finish[np.maximum(next_remaining, 0), next_need, self.transitions[s]]
+            weights = np.where(next_remaining >= 0, self.probs[s] * finish, 0.0)
+            weights[:, self.end] = np.where((r == 0) & (v == 0), self.probs[s, self.end], 0.0)
+            cumulative = np.cumsum(weights, axis=1)
+            draws = rng.random(len(active)) * cumulative[:, -1]
+            units = np.minimum((cumulative <= draws[:, None]).sum(axis=1), len(self.vowel) - 1)
+            log_probs[active] += log10_probs(self.probs[s, units])
+            ended = units == self.end
+            active, s, units = active[~ended], s[~ended], units[~ended]
+            step = lengths[active[0]] if len(active) else 0
+            if step == phones.shape[1]:
+                phones = np.concatenate([phones, np.zeros_like(phones)], axis=1)
+            phones[active, step] = units + 1
+            lengths[active] += 1
+            remaining[active] -= self.increments[s, units]
+            need_vowel[active] &= ~self.vowel[units]
+            states[active] = self.transitions[s, units]
+        return self.lm.decode(phones, lengths), log_probs
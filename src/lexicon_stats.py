@@ -0,0 +1,92 @@
+"""Homophone and minimal-pair summaries of many lexica in one grouped pass.
+
+Every summary is a mean, maximum, sum or share of positive values of a column,
+so it can be computed from per-lexicon partial aggregates (row count, non-null
+count, sum, maximum and number of positive values). LexiconStats gathers those
+with a single groupby per DataFrame it is given, merges the partials of the same
+lexicon across DataFrames, and only then derives the summaries. Lexica can
+therefore be streamed one (or a chunk) at a time, e.g. from
+lexicon_store.iter_artificials, and never need to be in memory together."""
+
+import numpy as np
+import pandas as pd
+
+
+# (name, column, reduction, decimals), in the order of utils.get_stats_for_lexicon.
+STATISTICS = [
+    ('homophone_percentage', 'num_homophones', 'share_positive', 4),
+    ('mean_homophones', 'num_homophones', 'mean', 4),
+    ('max_homophones', 'num_homophones', 'max', 2),
+    ('mean_mp', 'neighborhood_size', 'mean', 4),
+    ('max_mp', 'neighborhood_size', 'max', 2),
+    ('total_mp', 'neighborhood_size', 'sum', 2),
+    ('mean_mp_w_hp', 'neighborhood_size_with_homophones', 'mean', 4),
+    ('max_mp_w_hp', 'neighborhood_size_with_homophones', 'max', 2),
+    ('total_mp_w_hp', 'neighborhood_size_with_homophones', 'sum', 2),
+]
+
+
+class LexiconStats:
+    """Accumulate summary statistics of lexica over a stream of DataFrames.
+
+    Parameters
+    ----------
+    by: str (default 'lexicon')
+       column identifying the lexicon of each row; None treats every row as
+       belonging to a single lexicon
+    statistics: list of (str, str, str, int) (default None)
+       (name, column, reduction, decimals) of each summary, reduction being one
+       of 'mean', 'max', 'sum' or 'share_positive'; None uses those of
+       STATISTICS whose column is in the first DataFrame
+    """
+
+    def __init__(self, by='lexicon', statistics=None):
+        self.by = by
+        self.statistics = statistics
+        self.parts = []
+
+    def update(self, df):
+        """Add the rows of df (one or several lexica, whole or in part); returns self."""
+        if self.statistics is None:
+            self.statistics = [s for s in STATISTICS if s[1] in df.columns]
+        columns = list(dict.fromkeys(column for _, column, _, _ in self.statistics))
+        values = df[columns]
+        positive = (values > 0).add_suffix('>0')
+        keys = df[self.by].to_numpy() if self.by is not None else np.zeros(len(df), dtype=np.int64)
+        grouped = pd.concat([values, positive], axis=1).groupby(keys, sort=False)
+        part = pd.concat([grouped[columns].agg(['count', 'sum', 'max']),
+                          grouped[list(positive.columns)].sum().set_axis(
+                              pd.MultiIndex.from_product([columns, ['positive']]), axis=1)], axis=1)
+        part[('', 'rows')] = grouped.size()
+        self.parts.append(part)
+        return self
+
+    def result(self):
+        """One row of summaries per lexicon, indexed by lexicon in order of first appearance."""
+        parts = pd.concat(self.parts)
+        how = {c: 'max' if c[1] == 'max' else 'sum' for c in parts.columns}
+        totals = parts.groupby(level=0, sort=False).agg(how) if len(self.parts) > 1 else parts
+        stats = pd.DataFrame(index=totals.index)
+        for name, column, reduction, decimals in self.statistics:
+            if reduction == 'share_positive':
+                value = totals[(column, 'positive')] / totals[('', 'rows')]
+            elif reduction == 'mean':
+                value = totals[(column, 'sum')] / totals[(column, 'count')]
+            else:
+                value = totals[(column, reduction)]
+            stats[name] = value.round(decimals)
+        stats.index.name = self.by
+        return stats
+
+
+def lexicon_stats(df, by='lexicon', statistics=None):
+    """Summaries of every lexicon in df; see LexiconStats."""
+    return LexiconStats(by=by, statistics=statistics).update(df).result()
+
+
+def stream_lexicon_stats(lexica, by='lexicon', statistics=None):
+    """Summaries of a stream of DataFrames of lexica, holding only one of them at a time."""
+    accumulator = LexiconStats(by=by, statistics=statistics)
+    for df in lexica:
+        accumulator.update(df)
+    return accumulator.result()
@@ -0,0 +1,273 @@
+"""Columnar on-disk storage for sets of lexica, partitioned by lexicon.
+
+A lexicon set is a directory with one raw binary file per numeric column and,
+for each text column, per-row codes into a string pool of every partition's
+distinct values. An index in meta.json records where each lexicon's rows and
+pool entries start, so one lexicon, or a few columns, can be read through
+memory maps without scanning the rest of the set."""
+
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+
+SUFFIX = ".lexica"
+INDEX_COLUMN = "__index__"
+
+
+def store_path(csv_path):
+    """Directory used instead of csv_path when lexica are stored columnar."""
+    return csv_path[:-len(".csv")] + SUFFIX if csv_path.endswith(".csv") else csv_path + SUFFIX
+
+
+class LexiconSetWriter:
+    """Append lexica to a lexicon set one at a time.
+
+    Parameters
+    ----------
+    path: str
+       directory of the set; any existing set there is replaced
+    """
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        for f in os.listdir(path):
+            os.remove(os.path.join(path, f))
+        self.columns = None
+        self.partitions = []
+        self.rows = 0
+        self.pool_sizes = {}
+
+    def append(self, df, lexicon=None):
+        """Write the rows of one lexicon (by default, the single value of df['lexicon'])."""
+        if lexicon is None:
+            lexicon = df['lexicon'].iloc[0] if len(df) else len(self.partitions)
+        df = df.copy()
+        df[INDEX_COLUMN] = df.index
+        if self.columns is None:
+            self.columns = {c: _kind(df[c]) for c in df.columns}
+            self.pool_sizes = {c: 0 for c, kind in self.columns.items() if kind == 'text'}
+        if list(df.columns) != list(self.columns):
+            raise ValueError("Lexica in a set must share their columns.")
+        pools = {}
+        for column, kind in self.columns.items():
+            values = df[column]
+            if kind != 'text':
+                self._write(column, values.to_numpy(dtype=kind))
+                continue
+            codes, uniques = pd.factorize(values, use_na_sentinel=True)
+            encoded = [s.encode("utf-8") for s in uniques.tolist()]
+            ends = np.cumsum([len(b) for b in encoded], dtype=np.int64)
+            previous = self._chars(column)
+            self._write(column + ".codes", codes.astype(np.int32))
+            self._write(column + ".ends", ends + previous)
+            self._write(column + ".chars", np.frombuffer(b"".join(encoded), dtype=np.uint8))
+            pools[column] = [self.pool_sizes[column], self.pool_sizes[column] + len(encoded)]
+            self.pool_sizes[column] += len(encoded)
+        self.partitions.append({'lexicon': _plain(lexicon), 'rows': [self.rows, self.rows + len(df)], 'pools': pools})
+        self.rows += len(df)
+        self._write_meta()
+
+    def close(self):
+        if self.columns is None:
+            self.columns = {}
+        self._write_meta()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _chars(self, column):
+        path = os.path.join(self.path, column + ".chars")
+        return os.path.getsize(path) if os.path.exists(path) else 0
+
+    def _write(self, name, array):
+        with open(os.path.join(self.path, name), "ab") as f:
+            f.write(np.ascontiguousarray(array).tobytes())
+
+    def _write_meta(self):
+        # Written after every lexicon, so a partly written set can already be read.
+        with open(os.path.join(self.path, "meta.json"), "w") as f:
+            json.dump({'columns': self.columns, 'partitions': self.partitions}, f)
+
+
+class LexiconSet:
+    """Read-only view of a lexicon set written by LexiconSetWriter."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        self.columns = meta['columns']
+        self.partitions = meta['partitions']
+        self.index = {p['lexicon']: i for i, p in enumerate(self.partitions)}
+
+    @property
+    def lexicons(self):
+        return [p['lexicon'] for p in self.partitions]
+
+    def read(self, lexicon, columns=None):
+        """One lexicon as a DataFrame, optionally restricted to some columns."""
+        partition = self.partitions[self.index[lexicon]]
+        start, stop = partition['rows']
+        columns = [c for c in self.columns if c != INDEX_COLUMN] if columns is None else list(columns)
+        data = {}
+        for column in columns:
+            kind = self.columns[column]
+            if kind != 'text':
+                data[column] = np.array(self._map(column, kind)[start:stop])
+                continue
+            first, last = partition['pools'][column]
+            ends = self._map(column + ".ends", np.int64)
+            chars = self._map(column + ".chars", np.uint8)
+            begin = ends[first - 1] if first > 0 else 0
+            raw = bytes(chars[begin:ends[last - 1]]) if last > first else b""
+            bounds = np.concatenate([[0], np.asarray(ends[first:last]) - begin]).tolist()
+            pool = np.array([raw[bounds[i]:bounds[i + 1]].decode("utf-8") for i in range(last - first)] + [np.nan],
+                            dtype=object)
+            # Code -1 marks a missing value, which picks the trailing NaN of the pool.
+            data[column] = pool[np.asarray(self._map(column + ".codes", np.int32)[start:stop])]
+        index = pd.Index(np.array(self._map(INDEX_COLUMN, self.columns[INDEX_COLUMN])[start:stop]))
+        return pd.DataFrame(data, index=index, columns=columns)
+
+    def __len__(self):
+        return len(self.partitions)
+
+    def __getitem__(self, lexicon):
+        return self.read(lexicon)
+
+    def __iter__(self):
+        """Lexica in the order they were written, read one at a time."""
+        return self.stream()
+
+    def stream(self, columns=None):
+        for lexicon in self.lexicons:
+            yield self.read(lexicon, columns=columns)
+
+    def to_frame(self, lexicons=None, columns=None):
+        """Concatenation of several lexica (all by default), like the CSV of the whole set."""
+        lexicons = self.lexicons if lexicons is None else lexicons
+        return pd.concat([self.read(lex, columns=columns) for lex in lexicons])
+
+    def _map(self, name, dtype):
+        path = os.path.join(self.path, name)
+        if os.path.getsize(path) == 0:
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(path, dtype=dtype, mode="r")
+
+
+class CsvLexiconWriter:
+    """Append lexica to a CSV file, which ends up as df.to_csv of their concatenation."""
+
+    def __init__(self, path):
+        self.path = path
+        self.header = True
+        open(path, "w").close()
+
+    def append(self, df, lexicon=None):
+        df.to_csv(self.path, mode="a", header=self.header)
+        self.header = False
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def write_lexica(df, path, by='lexicon'):
+    """Store a DataFrame of several lexica as a lexicon set, one partition per value of by."""
+    with LexiconSetWriter(path) as writer:
+        for lexicon, df_lex in df.groupby(by, sort=False):
+            writer.append(df_lex, lexicon)
+
+
+def save_artificials(df, csv_path, fmt='csv'):
+    """Write artificial lexica as csv_path, or as its lexicon set when fmt == 'lexica'."""
+    if fmt == 'lexica':
+        write_lexica(df, store_path(csv_path))
+    else:
+        _remove_store(csv_path)
+        df.to_csv(csv_path)
+
+
+def open_artificials_writer(csv_path, fmt='csv'):
+    """Writer appending artificial lexica one at a time, in the format of save_artificials."""
+    if fmt == 'lexica':
+        return LexiconSetWriter(store_path(csv_path))
+    _remove_store(csv_path)
+    return CsvLexiconWriter(csv_path)
+
+
+def iter_artificials(csv_path, columns=None, chunksize=100000):
+    """Artificial lexica saved by save_artificials, yielded one lexicon at a time.
+
+    Lexicon sets are read partition by partition through their index. CSV files
+    are read in chunks of rows and split where the lexicon changes, so each
+    lexicon's rows must be contiguous, as they are when written by this module;
+    either way at most one lexicon (plus one chunk) is held in memory."""
+    if os.path.isdir(store_path(csv_path)):
+        yield from LexiconSet(store_path(csv_path)).stream(columns=columns)
+        return
+    usecols = None if columns is None else lambda c: c in set(columns) | {'lexicon'}
+    pending = None
+    for chunk in pd.read_csv(csv_path, usecols=usecols, chunksize=chunksize):
+        if pending is not None:
+            chunk = pd.concat([pending, chunk])
+        ids = chunk['lexicon'].to_numpy()
+        starts = [0] + (np.flatnonzero(ids[1:] != ids[:-1]) + 1).tolist()
+        for start, stop in zip(starts[:-1], starts[1:]):
+            yield _select(chunk.iloc[start:stop], columns)
+        pending = chunk.iloc[starts[-1]:]
+    if pending is not None and len(pending):
+        yield _select(pending, columns)
+
+
+def split_lexica(df, N, by='lexicon'):
+    """The lexica 0..N-1 of a concatenated DataFrame, found in a single pass over it.
+
+    Same frames, in the same order, as df[df[by] == i] for i in range(N)."""
+    positions = df.groupby(by, sort=False).indices
+    for i in range(N):
+        yield df.iloc[positions.get(i, [])]
+
+
+def load_artificials(csv_path, lexicons=None, columns=None):
+    """Artificial lexica saved by save_artificials, from the lexicon set if there is one."""
+    if os.path.isdir(store_path(csv_path)):
+        return LexiconSet(store_path(csv_path)).to_frame(lexicons=lexicons, columns=columns)
+    df = pd.read_csv(csv_path, usecols=None if columns is None else lambda c: c in set(columns) | {'lexicon'})
+    if lexicons is not None:
+        df = df[df['lexicon'].isin(lexicons)]
+    return _select(df, columns)
+
+
+def _remove_store(csv_path):
+    # A lexicon set takes precedence when reading, so an outdated one must not linger.
+    if os.path.isdir(store_path(csv_path)):
+        shutil.rmtree(store_path(csv_path))
+
+
+def _select(df, columns):
+    return df if columns is None else df[list(columns)]
+
+
+def _kind(values):
+    """Storage kind of a column: a NumPy dtype string, or 'text'."""
+    if values.dtype.kind in "biuf":
+        return values.dtype.str
+    return 'text'
+
+
+def _plain(value):
+    """Lexicon label as a JSON-serializable Python value."""
+    return value.item() if hasattr(value, "item") else value
@@ -4,72 +4,208 @@ import os
 import os.path as op
 import pandas as pd 
 import itertools
-import math
+import time
 
-import editdistance as ed
-
-from collections import defaultdict
+from collections import defaultdict, deque
 from tqdm import tqdm
 
 import config 
-import utils
+import instrumentation
+from homophones import HomophoneIndex
+from lexicon_store import iter_artificials, open_artificials_writer, split_lexica
+from parallel_generation import fork_pool, share, worker_state
+
+
+# Words of each deletion shard; substitution shards are one (length, position) each.
+DELETION_CHUNK = 5000
+
+
+def find_minimal_pairs(wordforms, counts, processes=1, progress=False):
+	"""For each word, find number of minimal pairs.
+
+	"Minimal pair" is defined here as wordforms 1 edit away. Rather than comparing
+	every pair of wordforms, only candidates are visited: words of the same length
+	that agree everywhere but one position (substitutions), and words whose
+	single-character deletions are themselves wordforms (insertions/deletions).
+
+	The work is split into shards (one per length and position for substitutions,
+	chunks of DELETION_CHUNK words per length for deletions). With processes > 1 the
+	shards are counted in a pool of workers; the per-shard counts are integers, so
+	the merged result is the same whatever the number of processes.
 
+	progress=True reports candidate keys/sec, pairs found and ETA through a
+	PairProgress bar; any other factory taking the total number of keys (known in
+	closed form from the length buckets) can be passed instead. It is updated once
+	per shard, so its cost does not grow with the size of the lexicon."""
+	by_length = defaultdict(list)
+	for w in wordforms:
+		by_length[len(w)].append(w)
+	# Series lookups dominate the pair loop; a dict is much cheaper to query and to ship.
+	counts = dict(counts)
+
+	shards = []
+	for length in sorted(by_length):
+		shards += [('substitution', length, i) for i in range(length)]
+		if length - 1 in by_length:
+			shards += [('deletion', length, start) for start in range(0, len(by_length[length]), DELETION_CHUNK)]
+
+	if progress is True:
+		progress = PairProgress
+	reporter = progress(sum(_shard_keys(shard, by_length) for shard in shards)) if progress else None
 
-def find_minimal_pairs(wordforms, counts):
-	"""For each word, find number of minimal pairs."""
 	word_to_size = defaultdict(int)
 	word_to_size_with_homophones = defaultdict(int)
-	unique_combos = math.factorial(len(wordforms)) / (math.factorial(2) * (math.factorial(len(wordforms)-2)))
-	seen = []
-	with tqdm(total=unique_combos) as progress_bar:
-		for w1, w2 in itertools.combinations(wordforms, 2):
-			# "Minimal pair" is defined here as wordforms 1 distance away. .
-			if ed.eval(w1, w2) == 1:
-				word_to_size[w1] += 1
-				word_to_size[w2] += 1
-				word_to_size_with_homophones[w1] += counts[w2] + 1
-				word_to_size_with_homophones[w2] += counts[w1] + 1
-			progress_bar.update(1)
+	keys, total_pairs = 0, 0
+	for shard, (sizes, sizes_with_homophones, pairs) in zip(shards, _map_shards(shards, by_length, counts, processes)):
+		for w, size in sizes.items():
+			word_to_size[w] += size
+		for w, size in sizes_with_homophones.items():
+			word_to_size_with_homophones[w] += size
+		keys += _shard_keys(shard, by_length)
+		total_pairs += pairs
+		if reporter:
+			reporter.update(_shard_keys(shard, by_length), pairs)
+	if reporter:
+		reporter.close()
+	instrumentation.record('find_minimal_pairs', wordforms=sum(len(words) for words in by_length.values()),
+						   shards=len(shards), candidate_keys=keys, pairs=total_pairs)
 
 	return word_to_size, word_to_size_with_homophones
 
 
-def mps_for_lexicon(df_lex, phon_column="PhonDISC", unique=True):
+def _shard_keys(shard, by_length):
+	"""Number of candidate keys a shard builds: one per word, or one per deletion."""
+	kind, length, index = shard
+	if kind == 'substitution':
+		return len(by_length[length])
+	return length * len(by_length[length][index:index + DELETION_CHUNK])
+
+
+class PairProgress:
+	"""Progress bar over candidate keys, with the minimal pairs found and their rate.
+
+	Parameters
+	----------
+	total: int
+	   number of candidate keys find_minimal_pairs will build
+	"""
+
+	def __init__(self, total):
+		self.bar = tqdm(total=total, unit='key', unit_scale=True)
+		self.pairs = 0
+		self.start = time.perf_counter()
+
+	def update(self, keys, pairs):
+		self.pairs += pairs
+		elapsed = max(time.perf_counter() - self.start, 1e-9)
+		self.bar.set_postfix(pairs=self.pairs, pairs_per_sec="{r:.0f}".format(r=self.pairs / elapsed), refresh=False)
+		self.bar.update(keys)
+
+	def close(self):
+		self.bar.close()
+
+
+def _map_shards(shards, by_length, counts, processes):
+	"""Count minimal pairs for each shard, in this process or in a pool, in shard order."""
+	if processes == 1 or len(shards) <= 1:
+		share({'by_length': by_length, 'counts': counts})
+		for shard in shards:
+			yield _count_shard(shard)
+		return
+	# Words grouped by length and homophone counts are shared with the workers once.
+	with fork_pool(processes, {'by_length': by_length, 'counts': counts}) as pool:
+		yield from pool.imap(_count_shard, shards)
+
+
+def _count_shard(shard):
+	"""Minimal pair counts contributed by one shard, and the number of pairs."""
+	kind, length, index = shard
+	by_length, counts = worker_state()['by_length'], worker_state()['counts']
+	word_to_size = defaultdict(int)
+	word_to_size_with_homophones = defaultdict(int)
+	words = by_length[length]
+	if kind == 'substitution':
+		# Group words by the string left after blanking position index.
+		groups = defaultdict(list)
+		for w in words:
+			groups[w[:index] + w[index+1:]].append(w)
+		for group in groups.values():
+			for w1, w2 in itertools.combinations(group, 2):
+				_add_minimal_pair(w1, w2, counts, word_to_size, word_to_size_with_homophones)
+	else:
+		# Insertions/deletions: look up each distinct single deletion among shorter words.
+		shorter = set(by_length[length - 1])
+		for w1 in words[index:index + DELETION_CHUNK]:
+			for w2 in set(w1[:i] + w1[i+1:] for i in range(length)):
+				if w2 in shorter:
+					_add_minimal_pair(w1, w2, counts, word_to_size, word_to_size_with_homophones)
+	return dict(word_to_size), dict(word_to_size_with_homophones), sum(word_to_size.values()) // 2
+
+
+def _add_minimal_pair(w1, w2, counts, word_to_size, word_to_size_with_homophones):
+	"""Count w1 and w2 as each other's minimal pair."""
+	word_to_size[w1] += 1
+	word_to_size[w2] += 1
+	word_to_size_with_homophones[w1] += counts[w2] + 1
+	word_to_size_with_homophones[w2] += counts[w1] + 1
+
+
+def mps_for_lexicon(df_lex, phon_column="PhonDISC", unique=True, processes=1, progress=False):
 	"""Get minimal pairs for each word, put into lexicon."""
 	df_lex = df_lex.dropna(subset=[phon_column])
 
-	# Get homophone counts
-	homophone_counts = utils.get_homophone_counts(df_lex, column=phon_column)
-
-	# Get unique wordforms
-	wordforms = df_lex[phon_column].values
-	wordforms = set(wordforms)
+	# Homophone counts and unique wordforms, from one factorization of the column
+	homophones = HomophoneIndex.from_values(df_lex[phon_column])
+	wordforms = homophones.forms.tolist()
+	homophone_counts = dict(zip(wordforms, (homophones.counts - 1).tolist()))
 
 	# Print out num wordforms
 	num_wordforms = len(wordforms)
 	print("#words: {l}".format(l=num_wordforms))
 
 	# Get num of minimal pairs
-	neighborhood_size, neighborhood_size_with_homophones = find_minimal_pairs(wordforms, counts=homophone_counts)
-	df_lex['neighborhood_size'] = df_lex[phon_column].apply(lambda x: neighborhood_size[x])
-	df_lex['neighborhood_size_with_homophones'] = df_lex[phon_column].apply(lambda x: neighborhood_size_with_homophones[x])
+	neighborhood_size, neighborhood_size_with_homophones = find_minimal_pairs(
+		wordforms, counts=homophone_counts, processes=processes, progress=progress)
+	df_lex['neighborhood_size'] = homophones.take_dict(neighborhood_size)
+	df_lex['neighborhood_size_with_homophones'] = homophones.take_dict(neighborhood_size_with_homophones)
 	return df_lex
 
 
 
-def mps_for_artificials(df_arts, N):
+def mps_for_artificials(df_arts, N, processes=1):
 	"""For each artificial lexicon, get minimal pairs for each word."""
-	artificials = []
-	for lex in range(N):
-		df_lex = df_arts[df_arts['lexicon']==lex]
-		df_lex = mps_for_lexicon(df_lex, phon_column='word')
-		artificials.append(df_lex)
-	df_all_arts = pd.concat(artificials)
+	df_all_arts = pd.concat(iter_mps_for_artificials(split_lexica(df_arts, N), processes=processes, total=N))
 	
 	return df_all_arts
 
 
-def main(language, N, matched, mp_dir, phon_column="PhonDISC"):
+def iter_mps_for_artificials(lexica, processes=1, total=None):
+	"""Get minimal pairs for a stream of artificial lexica, yielding them in order.
+
+	With processes > 1, lexica are handed out whole to a pool of workers, and at
+	most two per worker are read ahead, so memory stays bounded by a few lexica."""
+	lexica = tqdm(lexica, total=total)
+	if processes == 1:
+		for df_lex in lexica:
+			yield _mps_for_artificial(df_lex)
+		return
+	with fork_pool(processes) as pool:
+		pending = deque()
+		for df_lex in lexica:
+			pending.append(pool.apply_async(_mps_for_artificial, (df_lex,)))
+			if len(pending) >= 2 * (processes or os.cpu_count()):
+				yield pending.popleft().get()
+		while pending:
+			yield pending.popleft().get()
+
+
+def _mps_for_artificial(df_lex):
+	lex_num = df_lex['lexicon'].iloc[0] if 'lexicon' in df_lex and len(df_lex) else None
+	with instrumentation.stage('minimal_pairs', lexicon=lex_num):
+		return mps_for_lexicon(df_lex, phon_column='word')
+
+
+def main(language, N, matched, mp_dir, phon_column="PhonDISC", processes=None):
 	"""Main script."""
 
 	## Load files
@@ -77,19 +213,25 @@ def main(language, N, matched, mp_dir, phon_column="PhonDISC"):
 	art_string = "{lan}_artificial_{N}_matched_on_{match}_no_restriction.csv".format(lan=language, N=N, match=matched)
 	artificial_path = op.join(dir_path, art_string)
 
-	# Load lexicons
-	df_real = pd.read_csv(op.join(dir_path, "{lan}_all_reals.csv".format(lan=language)))
-	df_artificials = pd.read_csv(artificial_path)
+	# Load real lexicon; artificial lexica are streamed one at a time below
+	with instrumentation.stage('load'):
+		df_real = pd.read_csv(op.join(dir_path, "{lan}_all_reals.csv".format(lan=language)))
 
 	# Get minimal pairs for real lexicon
 	print("Getting minimal pairs for real lexicon...")
-	df_real_mps = mps_for_lexicon(df_real, phon_column=phon_column)
-	df_real_mps.to_csv("{dir}/{lan}_all_mps.csv".format(dir=mp_dir, lan=language))
+	with instrumentation.stage('minimal_pairs', lexicon='real'):
+		df_real_mps = mps_for_lexicon(df_real, phon_column=phon_column, processes=processes, progress=True)
+	with instrumentation.stage('write', lexicon='real', rows=len(df_real_mps)):
+		df_real_mps.to_csv("{dir}/{lan}_all_mps.csv".format(dir=mp_dir, lan=language))
 
 	# Get minimal pairs for artificials
 	print("Getting minimal pairs for artificial lexicons...")
-	df_arts_mps = mps_for_artificials(df_artificials, N=N)
-	df_arts_mps.to_csv("{dir}/{f}".format(dir=mp_dir, f=art_string.replace("sylls", "sylls_mps")))
+	artificials = itertools.islice(iter_artificials(artificial_path), N)
+	output_path = "{dir}/{f}".format(dir=mp_dir, f=art_string.replace("sylls", "sylls_mps"))
+	with open_artificials_writer(output_path, config.OUTPUT_FORMAT) as writer:
+		for lex_num, df_lex in enumerate(iter_mps_for_artificials(artificials, processes=processes, total=N)):
+			with instrumentation.stage('write', lexicon=lex_num, rows=len(df_lex)):
+				writer.append(df_lex)
 
 
 
@@ -108,8 +250,13 @@ if __name__ == "__main__":
 	    print("Creating directory: {dir}".format(dir=mp_dir))
 	    os.mkdir(mp_dir)
 
+	# Stage timings and counters of this run go to config.INSTRUMENTATION_DIR
+	instrumentation.configure('minimal_pairs_{lan}'.format(lan=language), config.INSTRUMENTATION_DIR,
+							  profile_stage=config.PROFILE_STAGE, profiler=config.PROFILER)
+
 	# Run main script
-	main(language=language, N=N, matched=matched, mp_dir=mp_dir, phon_column=phon_column)
+	main(language=language, N=N, matched=matched, mp_dir=mp_dir, phon_column=phon_column,
+	     processes=config.PROCESSES)
 
 
 
@@ -0,0 +1,108 @@
+"""On-disk cache of compiled phonotactic models, addressed by their training data.
+
+A model is stored under the SHA-256 of its wordform list, n and smoothing, so a
+lexicon that has not changed maps to the same entry and is never retrained.
+Entries are CompiledNgramModel.save directories; loading memory-maps the arrays,
+which takes milliseconds and lets forked workers share the pages."""
+
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+
+import instrumentation
+from compiled_model import CompiledNgramModel
+
+
+# Bump when the stored format or the training code changes the models it produces.
+FORMAT_VERSION = 1
+
+
+def model_key(wordforms, n, smoothing):
+    """Content hash of the training wordforms (in order) and the model parameters."""
+    digest = hashlib.sha256("v{v} n={n} smoothing={s!r}\n".format(v=FORMAT_VERSION, n=n, s=smoothing).encode())
+    for w in wordforms:
+        digest.update(w.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class ModelCache:
+    """Directory of compiled models, evicting least recently used entries past max_bytes.
+
+    Parameters
+    ----------
+    directory: str
+       where entries are stored; created if missing
+    max_bytes: int (default None)
+       size bound of the cache; None never evicts
+    """
+
+    def __init__(self, directory, max_bytes=None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.directory, key)
+
+    def load(self, key):
+        """Memory-mapped model stored under key, or None."""
+        path = self.path(key)
+        try:
+            model = CompiledNgramModel.load(path)
+        except (OSError, ValueError):
+            return None
+        # Loading counts as a use for eviction.
+        now = time.time()
+        os.utime(path, (now, now))
+        return model
+
+    def store(self, key, model):
+        """Save model under key and evict old entries; returns the stored (memory-mapped) model."""
+        path = self.path(key)
+        if not os.path.exists(path):
+            # Write next to the final location and rename, so readers never see partial entries.
+            staging = tempfile.mkdtemp(dir=self.directory, prefix=".tmp-")
+            model.save(staging)
+            try:
+                os.rename(staging, path)
+            except OSError:
+                # Another process stored the same model first.
+                shutil.rmtree(staging, ignore_errors=True)
+        self.evict(keep=key)
+        return self.load(key)
+
+    def get(self, wordforms, n, smoothing, create):
+        """Cached model for these wordforms, or create(wordforms, n, smoothing) stored in the cache."""
+        key = model_key(wordforms, n, smoothing)
+        model = self.load(key)
+        instrumentation.record('model_cache', key=key, hit=model is not None)
+        if model is None:
+            model = self.store(key, create(wordforms, n, smoothing))
+        return model
+
+    def entries(self):
+        """(key, size in bytes, last use) of every stored model."""
+        entries = []
+        for key in os.listdir(self.directory):
+            path = self.path(key)
+            if key.startswith(".") or not os.path.isdir(path):
+                continue
+            size = sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+            entries.append((key, size, os.path.getmtime(path)))
+        return entries
+
+    def evict(self, keep=None):
+        """Remove least recently used entries until the cache fits in max_bytes."""
+        if self.max_bytes is None:
+            return
+        entries = sorted(self.entries(), key=lambda e: e[2])
+        total = sum(size for _, size, _ in entries)
+        for key, size, _ in entries:
+            if total <= self.max_bytes:
+                break
+            if key != keep:
+                shutil.rmtree(self.path(key), ignore_errors=True)
+                total -= size
@@ -0,0 +1,337 @@
+"""Integer-coded n-gram counts, trained in one pass and updated incrementally.
+
+NgramCounts keeps, for every order k = 1..n, the distinct k-grams of the
+training wordforms as rows of symbol codes, with their counts and the position
+of their first occurrence. Normalizing reproduces NgramModel's arithmetic
+exactly: sums over a context are accumulated in the order its continuations
+were first seen, as the dict-based model does."""
+
+import numpy as np
+
+try:
+    from .compiled_model import CompiledNgramModel, PAD, END
+except ImportError:
+    from compiled_model import CompiledNgramModel, PAD, END
+
+
+# Wordforms encoded per vectorized pass of update.
+_CHUNK = 100000
+
+
+class NgramCounts:
+    """Counts of all n-gram orders 1..n of a stream of wordforms.
+
+    Symbols are coded in order of first appearance, 0 being the start pad and 1
+    the end symbol, so adding wordforms never recodes what was already counted.
+
+    Parameters
+    ----------
+    n: int
+       highest n-gram order
+    symbols: list of str (default None)
+       alphabet to code first, e.g. alphabet() of a whole lexicon, so that counts
+       of parts of it share their codes; symbols not seen in training are not units
+    """
+
+    def __init__(self, n, symbols=None):
+        self.n = n
+        self.symbols = [PAD, END] + [s for s in (symbols or []) if s not in (PAD, END)]
+        self.codes = {s: i for i, s in enumerate(self.symbols)}
+        self.num_events = 0
+        # Per order k (index k-1): distinct k-grams, their counts and first occurrences.
+        self.ngrams = [np.zeros((0, k), dtype=np.int64) for k in range(1, n + 1)]
+        self.counts = [np.zeros(0, dtype=np.int64) for _ in range(n)]
+        self.first = [np.zeros(0, dtype=np.int64) for _ in range(n)]
+
+    @property
+    def units(self):
+        """Symbols that can be generated: everything seen in training, plus the end symbol."""
+        return [self.symbols[c] for c in self.ngrams[0][:, 0]]
+
+    def update(self, wordforms):
+        """Count the n-grams of more wordforms; returns self."""
+        chunk = []
+        for w in wordforms:
+            chunk.append(w)
+            if len(chunk) == _CHUNK:
+                self._count(chunk)
+                chunk = []
+        if chunk:
+            self._count(chunk)
+        return self
+
+    def truncate(self, n):
+        """Counts of orders 1..n only, the same as counting the wordforms with NgramCounts(n).
+
+        Lower-order k-grams do not depend on the highest order: padding only
+        precedes the events, and every k-gram ends on an event."""
+        if not 1 <= n <= self.n:
+            raise ValueError("Cannot truncate {m}-gram counts to order {n}.".format(m=self.n, n=n))
+        counts = NgramCounts(n)
+        counts.symbols, counts.codes, counts.num_events = list(self.symbols), dict(self.codes), self.num_events
+        counts.ngrams, counts.counts, counts.first = self.ngrams[:n], self.counts[:n], self.first[:n]
+        return counts
+
+    def _encode(self, words):
+        """Codes of the characters of words, concatenated, extending the alphabet as needed."""
+        points = np.frombuffer("".join(words).encode("utf-32-le"), dtype=np.uint32)
+        unique, first, inverse = np.unique(points, return_index=True, return_inverse=True)
+        for i in np.argsort(first, kind='stable'):
+            symbol = chr(unique[i])
+            if symbol not in self.codes:
+                self.codes[symbol] = len(self.symbols)
+                self.symbols.append(symbol)
+        lookup = np.array([self.codes[chr(p)] for p in unique], dtype=np.int64)
+        return lookup[inverse.ravel()]
+
+    def _count(self, words):
+        """Count the n-grams of one chunk of wordforms and merge them in."""
+        lengths = np.array([len(w) for w in words], dtype=np.int64)
+        # Each word becomes n-1 pads, its symbols and the end symbol.
+        sizes = lengths + self.n
+        starts = np.cumsum(sizes) - sizes
+        seq = np.zeros(sizes.sum(), dtype=np.int64)
+        char_starts = np.cumsum(lengths) - lengths
+        offsets = np.arange(lengths.sum()) - np.repeat(char_starts, lengths)
+        seq[np.repeat(starts + self.n - 1, lengths) + offsets] = self._encode(words)
+        seq[starts + self.n - 1 + lengths] = self.codes[END]
+        is_event = np.ones(len(seq), dtype=bool)
+        for j in range(self.n - 1):
+            is_event[starts + j] = False
+        events = np.flatnonzero(is_event)
+        positions = self.num_events + np.arange(len(events))
+        self.num_events += len(events)
+
+        base = len(self.symbols)
+        if base ** self.n >= 2 ** 62:
+            raise ValueError("Alphabet of {v} symbols is too large for a {n}-gram model.".format(
+                v=base, n=self.n))
+        for k in range(1, self.n + 1):
+            new = np.stack([seq[events - (k - 1) + j] for j in range(k)], axis=1)
+            ngrams = np.concatenate([self.ngrams[k - 1], new])
+            counts = np.concatenate([self.counts[k - 1], np.ones(len(new), dtype=np.int64)])
+            first = np.concatenate([self.first[k - 1], positions])
+            # np.unique with return_index sorts stably, so each k-gram keeps its first occurrence.
+            _, index, inverse = np.unique(_pack_rows(ngrams, base), return_index=True, return_inverse=True)
+            order = np.argsort(first[index], kind='stable')
+            self.ngrams[k - 1] = ngrams[index[order]]
+            self.first[k - 1] = first[index[order]]
+            self.counts[k - 1] = np.bincount(inverse.ravel(), weights=counts, minlength=len(index))[order].astype(np.int64)
+
+    def normalize(self, smoothing=0):
+        """Conditional probabilities and backoff weights of every order.
+
+        Returns
+        -------
+        list of (np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray)
+           for each order k: the k-grams, their probabilities, the index of each
+           k-gram's context, the distinct contexts and their backoff weights
+           (None without smoothing); all in order of first occurrence
+        """
+        base = len(self.symbols)
+        num_units = len(self.ngrams[0])
+        orders = []
+        lower_keys = lower_probs = None
+        for k in range(1, self.n + 1):
+            ngrams, counts = self.ngrams[k - 1], self.counts[k - 1].astype(np.float64)
+            _, first_pair, context_index = np.unique(_pack_rows(ngrams[:, :-1], base), return_index=True,
+                                                     return_inverse=True)
+            context_index = context_index.ravel()
+            # Renumber contexts by first occurrence.
+            renumber = np.empty(len(first_pair), dtype=np.int64)
+            renumber[np.argsort(first_pair, kind='stable')] = np.arange(len(first_pair))
+            context_index = renumber[context_index]
+            contexts = ngrams[np.sort(first_pair), :-1]
+            totals = np.bincount(context_index, weights=counts, minlength=len(contexts))
+            probs = (counts + smoothing) / (totals[context_index] + smoothing * num_units)
+            alphas = None
+            if smoothing:
+                if k == 1:
+                    lower = np.zeros(len(ngrams))
+                else:
+                    keys = _pack_rows(ngrams[:, 1:], base)
+                    lower = lower_probs[np.searchsorted(lower_keys, keys)]
+                mass = _sequential_sums(probs, context_index, len(contexts))
+                backed_off = _sequential_sums(lower, context_index, len(contexts))
+                alphas = (1 - mass) / (1 - backed_off)
+            orders.append((ngrams, probs, context_index, contexts, alphas))
+            keys = _pack_rows(ngrams, base)
+            sort = np.argsort(keys)
+            lower_keys, lower_probs = keys[sort], probs[sort]
+        return orders
+
+    def compile(self, smoothing=0):
+        """CompiledNgramModel of these counts, identical to compiling the trained NgramModel."""
+        units = sorted(self.units)
+        context_keys, alphas, pair_keys, pair_probs = self._model_arrays(units, smoothing)
+        order, pair_order = np.argsort(context_keys), np.argsort(pair_keys)
+        return CompiledNgramModel(self.n, smoothing, units, context_keys[order], alphas[order],
+                                  pair_keys[pair_order], pair_probs[pair_order])
+
+    def _model_arrays(self, units, smoothing):
+        """Unsorted context keys, backoff weights, pair keys and probabilities of compile.
+
+        Symbols are coded by their position in units, which may hold more symbols
+        than were seen in these counts."""
+        base = len(units) + 2
+        recode = np.zeros(len(self.symbols), dtype=np.int64)
+        for i, u in enumerate(units):
+            if u in self.codes:
+                recode[self.codes[u]] = i + 1
+        context_keys, alphas, pair_keys, pair_probs = [], [], [], []
+        for k, (ngrams, probs, context_index, contexts, weights) in enumerate(self.normalize(smoothing), 1):
+            keys = _pack_rows(recode[contexts], base)
+            context_keys.append(keys + base ** (k - 1))
+            alphas.append(weights if weights is not None else np.ones(len(contexts)))
+            pair_keys.append(keys[context_index] * base + recode[ngrams[:, -1]] + base ** k)
+            pair_probs.append(probs)
+        return (np.concatenate(context_keys), np.concatenate(alphas), np.concatenate(pair_keys),
+                np.concatenate(pair_probs))
+
+
+class SplitNgramCounts:
+    """Counts of a lexicon and of the two halves of a split, in one table of distinct n-grams.
+
+    Each half is counted once, with the alphabet of the whole lexicon, and the
+    counts of the whole are the sum of the halves'. Every order keeps its distinct
+    k-grams once, with a count and a first occurrence per half, so the three sets
+    of counts cost little more than the complete one.
+
+    The words of each half are counted in their order in the lexicon, so first
+    occurrences can all be expressed as positions in the whole lexicon, and
+    counts_of gives exactly the NgramCounts of the whole lexicon, or of a half
+    taken in that order.
+
+    Parameters
+    ----------
+    n: int
+       highest n-gram order
+    wordforms: list of str
+       the whole lexicon
+    halves: (list of int, list of int)
+       positions in wordforms of the words of each half; together, each word once
+    """
+
+    def __init__(self, n, wordforms, halves):
+        self.n = n
+        self.halves = [np.sort(np.asarray(half, dtype=np.int64)) for half in halves]
+        symbols = alphabet(wordforms)
+        parts = [NgramCounts(n, symbols=symbols).update([wordforms[i] for i in half]) for half in self.halves]
+        self.symbols = parts[0].symbols
+        self.num_events = [p.num_events for p in parts]
+        # Where each event of a half falls in the event stream of the whole lexicon.
+        sizes = np.array([len(w) + 1 for w in wordforms], dtype=np.int64)
+        starts = np.cumsum(sizes) - sizes
+        self.ngrams, self.counts, self.first = [], [], []
+        base = len(self.symbols)
+        for k in range(n):
+            keys = np.concatenate([_pack_rows(p.ngrams[k], base) for p in parts])
+            unique, index, inverse = np.unique(keys, return_index=True, return_inverse=True)
+            inverse = inverse.ravel()
+            counts = np.zeros((2, len(unique)), dtype=np.int64)
+            # -1 where a k-gram does not occur in a half.
+            first = np.full((2, len(unique)), -1, dtype=np.int64)
+            offset = 0
+            for h, (p, half) in enumerate(zip(parts, self.halves)):
+                part = inverse[offset:offset + len(p.counts[k])]
+                offset += len(p.counts[k])
+                counts[h, part] = p.counts[k]
+                first[h, part] = _whole_positions(p.first[k], sizes[half], starts[half])
+            self.ngrams.append(np.concatenate([p.ngrams[k] for p in parts])[index])
+            self.counts.append(counts)
+            self.first.append(first)
+
+    def counts_of(self, part=None):
+        """NgramCounts of half 0, half 1, or (part=None) of the whole lexicon."""
+        counts = NgramCounts(self.n, symbols=self.symbols)
+        counts.num_events = sum(self.num_events) if part is None else self.num_events[part]
+        for k in range(self.n):
+            if part is None:
+                first = self.first[k]
+                ngrams, count = self.ngrams[k], self.counts[k].sum(axis=0)
+                first = np.where(first[0] < 0, first[1], np.where(first[1] < 0, first[0], first.min(axis=0)))
+            else:
+                keep = self.counts[k][part] > 0
+                ngrams, count, first = self.ngrams[k][keep], self.counts[k][part][keep], self.first[k][part][keep]
+            order = np.argsort(first, kind='stable')
+            counts.ngrams[k], counts.counts[k], counts.first[k] = ngrams[order], count[order], first[order]
+        return counts
+
+    def compile(self, smoothing=0):
+        """Compiled models of the whole lexicon, half 0 and half 1, sharing their key tables.
+
+        The contexts and (context, unit) pairs of the whole lexicon are those of
+        either half, so the three models share its units, context_keys and
+        pair_keys arrays; each half only adds its own backoff weights and
+        probabilities, NaN where it lacks a context or pair (a partial model).
+        Probabilities are those of counts_of(part).compile: a half scores and
+        generates as if compiled on its own.
+
+        Returns
+        -------
+        (CompiledNgramModel, CompiledNgramModel, CompiledNgramModel)
+        """
+        parts = [self.counts_of(part) for part in (None, 0, 1)]
+        units = sorted(parts[0].units)
+        context_keys, alphas, pair_keys, pair_probs = parts[0]._model_arrays(units, smoothing)
+        order, pair_order = np.argsort(context_keys), np.argsort(pair_keys)
+        context_keys, pair_keys = context_keys[order], pair_keys[pair_order]
+        models = [CompiledNgramModel(self.n, smoothing, units, context_keys, alphas[order], pair_keys,
+                                     pair_probs[pair_order])]
+        for part in parts[1:]:
+            keys, weights, pairs, probs = part._model_arrays(units, smoothing)
+            models.append(CompiledNgramModel(self.n, smoothing, units, context_keys, _spread(context_keys, keys, weights),
+                                             pair_keys, _spread(pair_keys, pairs, probs), partial=True))
+        return tuple(models)
+
+
+def alphabet(wordforms):
+    """Characters of wordforms, in order of first appearance."""
+    points = np.frombuffer("".join(wordforms).encode("utf-32-le"), dtype=np.uint32)
+    unique, first = np.unique(points, return_index=True)
+    return [chr(p) for p in unique[np.argsort(first)]]
+
+
+def _whole_positions(positions, sizes, starts):
+    """Event positions within the words of a half, as positions in the whole lexicon.
+
+    sizes and starts are the number of events of each word of the half and the
+    position of its first event in the whole lexicon, in the order counted."""
+    half_starts = np.cumsum(sizes) - sizes
+    word = np.searchsorted(half_starts, positions, side='right') - 1
+    return starts[word] + positions - half_starts[word]
+
+
+def _spread(table, keys, values):
+    """values placed at the positions of their keys in a sorted key table; NaN elsewhere."""
+    spread = np.full(len(table), np.nan)
+    spread[np.searchsorted(table, keys)] = values
+    return spread
+
+
+def _pack_rows(rows, base):
+    """Pack each row of symbol codes into one integer key."""
+    keys = np.zeros(len(rows), dtype=np.int64)
+    for j in range(rows.shape[1]):
+        keys = keys * base + rows[:, j]
+    return keys
+
+
+def _sequential_sums(values, groups, num_groups):
+    """Sum values within each group, adding them one at a time in the order given.
+
+    This matches summing a dict's values in insertion order, which pairwise
+    summation (np.sum, np.bincount) does not always do bit for bit."""
+    # Rank of each value within its group; the stable sort keeps the given order.
+    by_group = np.argsort(groups, kind='stable')
+    sorted_groups = groups[by_group]
+    rank = np.empty(len(groups), dtype=np.int64)
+    rank[by_group] = np.arange(len(groups)) - np.searchsorted(sorted_groups, sorted_groups)
+    sums = np.zeros(num_groups, dtype=np.float64)
+    # Equal ranks touch distinct groups, so each pass adds one term to every group.
+    order = np.argsort(rank, kind='stable')
+    bounds = np.searchsorted(rank[order], np.arange(rank.max() + 2 if len(rank) else 1))
+    for r in range(len(bounds) - 1):
+        idx = order[bounds[r]:bounds[r + 1]]
+        sums[groups[idx]] += values[idx]
+    return sums
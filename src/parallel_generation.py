@@ -0,0 +1,104 @@
+"""Build artificial lexica in a pool of worker processes with reproducible seeds.
+
+fork_pool, share and worker_state are the worker pool of every parallel step
+(generation, minimal pairs, regressions, cross-validation): each pool hands its
+workers their shared state once, when they start."""
+
+import json
+import multiprocessing
+
+import numpy as np
+from tqdm import tqdm
+
+try:
+    from . import instrumentation
+except ImportError:
+    import instrumentation
+
+
+# Set in each worker by fork_pool (or by share, to run tasks in this process): the state its tasks read.
+_WORKER = {}
+
+
+def fork_pool(processes, state=None):
+    """Pool of worker processes, forked where the platform allows.
+
+    state (a dict, e.g. a model and its arguments) is handed to each worker once,
+    when it starts, and read by tasks through worker_state(): with the fork start
+    method it is shared copy-on-write, otherwise it is pickled once per worker."""
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context('fork' if 'fork' in methods else None)
+    return context.Pool(processes, initializer=share, initargs=(state or {},))
+
+
+def share(state):
+    """Add state to the worker state of this process, as fork_pool does in each worker."""
+    _WORKER.update(state)
+
+
+def worker_state():
+    """The state handed to this process by fork_pool or share."""
+    return _WORKER
+
+
+def lexicon_seeds(seed, iterations):
+    """Independent seed sequence for each lexicon.
+
+    Lexicon k's seed depends only on seed and k, so it is the same whatever the
+    number of workers, and any single lexicon can be rebuilt on its own."""
+    return np.random.SeedSequence(seed).spawn(iterations)
+
+
+def save_seeds(seeds, path):
+    """Record the entropy and per-lexicon spawn keys needed to rebuild every lexicon."""
+    with open(path, "w") as f:
+        json.dump({'entropy': seeds[0].entropy if seeds else None,
+                   'spawn_keys': [list(s.spawn_key) for s in seeds]}, f)
+
+
+def _build(job):
+    lex_num, seed = job
+    with instrumentation.stage('generate', lexicon=lex_num):
+        state = worker_state()
+        return state['build'](lex_num=lex_num, rng=np.random.default_rng(seed), **state['build_args'])
+
+
+def generate_lexica(build, iterations, seed=None, processes=None, **build_args):
+    """Build iterations lexica with build(lex_num=k, rng=..., **build_args).
+
+    The model and other build_args are handed to the workers once, when the pool
+    starts: with the fork start method they are shared copy-on-write, otherwise
+    they are pickled once per worker.
+
+    Parameters
+    ----------
+    build: function
+       lexicon builder, e.g. build_lexicon or build_lexicon_by_length
+    iterations: int
+       number of lexica to build
+    seed: int (default None)
+       base seed; None draws fresh entropy, which is returned with the seeds
+    processes: int (default None)
+       number of worker processes; None uses every core, 1 builds in this process
+
+    Returns
+    -------
+    (list of pd.DataFrame, list of np.random.SeedSequence)
+       the lexica in order of lex_num, and the seed used for each
+    """
+    seeds = lexicon_seeds(seed, iterations)
+    return list(iter_lexica(build, seeds, processes=processes, **build_args)), seeds
+
+
+def iter_lexica(build, seeds, processes=None, **build_args):
+    """Yield the lexica of generate_lexica one at a time, in order of lex_num, as they are built.
+
+    seeds comes from lexicon_seeds; lexicon k is built from seeds[k]."""
+    jobs = list(enumerate(seeds))
+    if processes == 1:
+        share({'build': build, 'build_args': build_args})
+        for job in tqdm(jobs):
+            yield _build(job)
+        return
+    with fork_pool(processes, {'build': build, 'build_args': build_args}) as pool:
+        yield from tqdm(pool.imap(_build, jobs), total=len(jobs))
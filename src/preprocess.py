@@ -2,20 +2,60 @@
 
 
 import utils
+import instrumentation
+
+import numpy as np
+import pandas as pd
 
 from collections import Counter
 from generative_model import *
-
-from sklearn.model_selection import train_test_split
-
-
-def create_model(wordforms, n=5, smoothing=.01):
-    """Create n-gram model."""
+from ngram_counts import NgramCounts, SplitNgramCounts
+from compiled_model import compile_model
+
+
+def create_model(wordforms, n=5, smoothing=.01, compiled=False, cache=None):
+    """Create n-gram model.
+
+    With compiled=True, return the frozen array-backed CompiledNgramModel instead.
+    With a model_cache.ModelCache, the compiled model is loaded from the cache, and
+    only trained (and stored) if these wordforms were never seen with n and smoothing."""
+    if cache is not None:
+        return cache.get(wordforms, n, smoothing,
+                         lambda wordforms, n, smoothing: create_model(wordforms, n, smoothing, compiled=True))
+    if compiled:
+        # Counted straight into arrays, without building NgramModel's dicts.
+        return NgramCounts(n).update(wordforms).compile(smoothing)
     lm = NgramModel(n, wordforms, 1)
     lm.create_model(wordforms, smoothing)
     return lm
 
 
+def create_split_models(wordforms, n=5, smoothing=.01, test_size=.5, random_state=None):
+    """Compiled models of wordforms and of the two halves of a random split of it.
+
+    Each half is counted once, and the complete model comes from the sum of the
+    halves' counts (see ngram_counts.SplitNgramCounts), rather than counting the
+    lexicon three times. The three models share one table of contexts and pairs,
+    so their memory grows with the contexts of the lexicon, not with the number
+    of models.
+
+    Returns
+    -------
+    (CompiledNgramModel, CompiledNgramModel, CompiledNgramModel, list, list)
+       the complete, first-half and second-half models, and the wordforms of the
+       two halves (in their order in wordforms)
+    """
+    # Imported here: scikit-learn takes longer to import than the rest of the generation path.
+    from sklearn.model_selection import train_test_split
+
+    build_index, evaluate_index = train_test_split(np.arange(len(wordforms)), test_size=test_size,
+                                                   random_state=random_state)
+    counts = SplitNgramCounts(n, wordforms, (build_index, evaluate_index))
+    model, build_model, evaluate_model = counts.compile(smoothing)
+    halves = [[wordforms[i] for i in half] for half in counts.halves]
+    return model, build_model, evaluate_model, halves[0], halves[1]
+
+
 def obtain_length_distribution(dataframe, match_on="phones"):
     """Obtain length distribution."""
     if match_on == 'phones':
@@ -24,11 +64,25 @@ def obtain_length_distribution(dataframe, match_on="phones"):
         return Counter(list(dataframe['num_sylls_est']))
 
 
+def training_wordforms(df, language, phon_column="PhonDISC", word_column="Word", vowels="IE{VQU@i#$u312456789cq0~"):
+    """Wordforms preprocess_lexicon trains its model on, in the same order.
+
+    Words estimated to have no syllables and words excluded by utils.remove_word
+    are dropped, and homophones are kept once, so a model trained on these
+    wordforms has the same ModelCache key as the pipeline's."""
+    df = df.dropna(subset=[phon_column])
+    df = df[utils.count_syllables_batch(df[phon_column], language=language, vowels=vowels) > 0].copy()
+    return list(utils.preprocess_for_analysis(df, word_column=word_column, phon_column=phon_column,
+                                              verbose=False)[phon_column])
+
+
 def preprocess_lexicon(df, language, phon_column="PhonDISC", word_column="Word", vowels="IE{VQU@i#$u312456789cq0~",
-                       n=5, smoothing=.01, match_on="phones"):
-    """Preprocess Celex dataframe."""
-    df['num_phones'] = df[phon_column].apply(lambda x: len(x))
-    df['num_sylls_est'] = df[phon_column].apply(lambda x: utils.count_syllables(x, language=language, vowels=vowels))
+                       n=5, smoothing=.01, match_on="phones", cache=None):
+    """Preprocess Celex dataframe.
+
+    With a model_cache.ModelCache, the returned model is the cached compiled model."""
+    df['num_phones'] = df[phon_column].str.len()
+    df['num_sylls_est'] = utils.count_syllables_batch(df[phon_column], language=language, vowels=vowels)
 
     # Remove words estimates to have <1 syllables.
     df = df[df['num_sylls_est'] > 0]
@@ -45,13 +99,16 @@ def preprocess_lexicon(df, language, phon_column="PhonDISC", word_column="Word",
     # Build n-gram model.
     print("Creating phonotactic model...")
     unique_wordforms = list(df_processed[phon_column])
-    model = create_model(unique_wordforms, n=n, smoothing=smoothing)
+    with instrumentation.stage('train', wordforms=len(unique_wordforms), n=n):
+        model = create_model(unique_wordforms, n=n, smoothing=smoothing, cache=cache)
 
     # Obtain surprisal estimates
-    df_processed['log_prob'] = df_processed[phon_column].apply(lambda x: model.evaluate(x)[2])
-    df_processed['surprisal'] = df_processed['log_prob'].apply(lambda x: -x)
-    df['log_prob'] = df[phon_column].apply(lambda x: model.evaluate(x)[2])
-    df['surprisal'] = df['log_prob'].apply(lambda x: -x)
+    with instrumentation.stage('score', wordforms=len(df_processed) + len(df)):
+        scorer = compile_model(model) if isinstance(model, NgramModel) else model
+        df_processed['log_prob'] = scorer.evaluate_batch(df_processed[phon_column])[2]
+        df_processed['surprisal'] = -df_processed['log_prob']
+        df['log_prob'] = scorer.evaluate_batch(df[phon_column])[2]
+        df['surprisal'] = -df['log_prob']
 
     # Save dataframes to file
     """
@@ -67,12 +124,64 @@ def preprocess_lexicon(df, language, phon_column="PhonDISC", word_column="Word",
             'original_lexicon': unique_wordforms}
 
 
+def preprocess_lexicon_chunks(chunks, language, phon_column="PhonDISC", word_column="Word",
+                              vowels="IE{VQU@i#$u312456789cq0~", n=5, smoothing=.01, match_on="phones", cache=None):
+    """Streaming preprocess_lexicon over DataFrame chunks (e.g. raw_lexicon.read_raw_lexicon).
+
+    Length distributions and homophone counts are accumulated chunk by chunk, and
+    only the first row of each wordform is kept, so memory grows with the number
+    of distinct wordforms rather than with the size of the raw lexicon. The model
+    and length distributions are the same as preprocess_lexicon on the whole file.
+
+    Returns
+    -------
+    dict
+       as preprocess_lexicon, plus 'lexicon': the unique wordforms with their
+       number of homophones, as in utils.preprocess_for_analysis
+    """
+    original_counts, homophone_counts = Counter(), Counter()
+    firsts = []
+    num_tokens = 0
+    for df in chunks:
+        df = df.copy()
+        df['num_phones'] = df[phon_column].str.len()
+        df['num_sylls_est'] = utils.count_syllables_batch(df[phon_column], language=language, vowels=vowels)
+        df = df[df['num_sylls_est'] > 0]
+        original_counts.update(obtain_length_distribution(df, match_on=match_on))
+
+        # Same filters as utils.preprocess_for_analysis, one chunk at a time
+        df = df.dropna(subset=[word_column])
+        df = df[~df[word_column].apply(utils.remove_word)]
+        num_tokens += len(df)
+        forms = df[phon_column]
+        new = ~forms.isin(homophone_counts) & ~forms.duplicated()
+        homophone_counts.update(forms.value_counts().to_dict())
+        firsts.append(df[new])
+
+    df_processed = pd.concat(firsts)
+    df_processed['num_homophones'] = df_processed[phon_column].map(homophone_counts) - 1
+    df_processed = df_processed.reset_index()
+    unique_counts = obtain_length_distribution(df_processed, match_on=match_on)
+    print("Number of tokens: {t}".format(t=num_tokens))
+    print(len(df_processed))
+
+    # Build n-gram model.
+    print("Creating phonotactic model...")
+    unique_wordforms = list(df_processed[phon_column])
+    with instrumentation.stage('train', wordforms=len(unique_wordforms), n=n):
+        model = create_model(unique_wordforms, n=n, smoothing=smoothing, cache=cache)
+    return {'model': model,
+            'original_counts': original_counts,
+            'unique_counts': unique_counts,
+            'original_lexicon': unique_wordforms,
+            'lexicon': df_processed}
+
 
 def preprocess_lexicon_split(df, language, phon_column="PhonDISC", word_column="Word", vowels="IE{VQU@i#$u312456789cq0~",
                        n=5, smoothing=.01, match_on="phones"):
     """Preprocess Celex dataframe."""
-    df['num_phones'] = df[phon_column].apply(lambda x: len(x))
-    df['num_sylls_est'] = df[phon_column].apply(lambda x: utils.count_syllables(x, language=language, vowels=vowels))
+    df['num_phones'] = df[phon_column].str.len()
+    df['num_sylls_est'] = utils.count_syllables_batch(df[phon_column], language=language, vowels=vowels)
 
     # Remove words estimates to have <1 syllables.
     df = df[df['num_sylls_est'] > 0]
@@ -89,19 +198,17 @@ def preprocess_lexicon_split(df, language, phon_column="PhonDISC", word_column="
     # Build n-gram model.
     print("Creating phonotactic model...")
     unique_wordforms = list(df_processed[phon_column])
-    model_complete = create_model(unique_wordforms, n=n, smoothing=smoothing)
     print("Splitting real lexicon in two")
-    build_half, evaluate_half = train_test_split(unique_wordforms, test_size=.5)
+    model_complete, model_build, model_evaluate, build_half, evaluate_half = create_split_models(
+        unique_wordforms, n=n, smoothing=smoothing)
     print(len(build_half))
     print(len(evaluate_half))
-    model_build = create_model(build_half, n=n, smoothing=smoothing)
-    model_evaluate = create_model(evaluate_half, n=n, smoothing=smoothing)
 
     # Obtain surprisal estimates
-    df_processed['log_prob'] = df_processed[phon_column].apply(lambda x: model_complete.evaluate(x)[2])
-    df_processed['surprisal'] = df_processed['log_prob'].apply(lambda x: -x)
-    df['log_prob'] = df[phon_column].apply(lambda x: model_complete.evaluate(x)[2])
-    df['surprisal'] = df['log_prob'].apply(lambda x: -x)
+    df_processed['log_prob'] = model_complete.evaluate_batch(df_processed[phon_column])[2]
+    df_processed['surprisal'] = -df_processed['log_prob']
+    df['log_prob'] = model_complete.evaluate_batch(df[phon_column])[2]
+    df['surprisal'] = -df['log_prob']
 
     # Save dataframes to file
     """
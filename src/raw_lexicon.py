@@ -0,0 +1,72 @@
+"""Read raw lexica and apply the per-language filters, whole or in chunks."""
+
+import pandas as pd
+
+import config
+
+
+def remove_stress(wordform):
+    """Remove stress markers to create unstressed version."""
+    print(wordform)
+    return wordform.replace("'", "").replace("-", "")
+
+def remap_transcription(wordform):
+    """Remap any phonemes represented by double characters to single characters."""
+    return _apply_remappings(wordform, config.PHONETIC_REMAPPINGS[config.LANGUAGE])
+
+def remap_transcriptions(wordforms, language):
+    """remap_transcription of many wordforms, with the remappings of language.
+
+    The wordforms are joined into one string and each remapping is applied once
+    to all of them. The replacements must stay sequential: the patterns overlap
+    ('ue' and 'ee' in 'uee'), so a single left-to-right pass would change results."""
+    wordforms = wordforms.tolist() if hasattr(wordforms, 'tolist') else list(wordforms)
+    mappings = config.PHONETIC_REMAPPINGS.get(language, {})
+    text = "\n".join(wordforms)
+    if text.count("\n") != len(wordforms) - 1:
+        # Some wordform holds the separator (or there are none): remap them one by one.
+        return [_apply_remappings(w, mappings) for w in wordforms]
+    return _apply_remappings(text, mappings).split("\n")
+
+def _apply_remappings(text, mappings):
+    for og, new in mappings.items():
+        text = text.replace(og, new)
+    return text
+
+
+def filter_raw_lexicon(df, language, verbose=True):
+    """Language-specific filtering of a raw lexicon (or of any chunk of it)."""
+    if language in ['dutch']:
+        df = df.dropna()
+        df['PhonDISC'] = df['PhonStrsDISC'].apply(lambda x: remove_stress(x))
+    elif language in ['french']:
+        # Keep only lemmas
+        df = df[df['14_islem']==1]
+        if verbose:
+            print(len(df))
+    elif language in ['japanese']:
+        # Remove proper names
+        df = df[df['morph_form']!="prop"]
+        if verbose:
+            print(len(df))
+        # Remove words with >1 pronunciation
+        df['multiple_pronunications'] = df['phonetic_form'].str.contains("/", regex=False)
+        df = df[df['multiple_pronunications']==False]
+        if verbose:
+            print(len(df))
+        # Now remap phonetic transcription so there's only one character per phoneme
+        df['phonetic_remapped'] = remap_transcriptions(df['phonetic_form'], language)
+    # TODO (mandarin): Homophones are already condensed in "homodensity". So maybe we need to "duplicate" an entry
+    # for each value in HomoDensity. Or maybe that should already be done before it gets to this point...
+    return df
+
+
+def read_raw_lexicon(language, chunksize=None):
+    """Filtered raw lexicon of language, from config.LEXICON_PATHS.
+
+    With a chunksize, yield it as filtered DataFrames of at most chunksize raw
+    rows, so only one chunk of the raw file is ever held in memory."""
+    path, sep = config.LEXICON_PATHS[language]
+    if chunksize is None:
+        return filter_raw_lexicon(pd.read_csv(path, sep=sep), language)
+    return (filter_raw_lexicon(chunk, language, verbose=False) for chunk in pd.read_csv(path, sep=sep, chunksize=chunksize))
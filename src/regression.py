@@ -0,0 +1,103 @@
+"""Fit the same Poisson regression to many lexica at once.
+
+The formula is parsed once, on the real lexicon; every other lexicon only has
+its design matrix built from the stored design, and the fits (Newton's method
+on the Poisson log-likelihood, as statsmodels' Poisson.fit does by default) run
+in a pool of worker processes."""
+
+import warnings
+
+import numpy as np
+import pandas as pd
+import patsy
+
+try:
+    from .parallel_generation import fork_pool
+except ImportError:
+    from parallel_generation import fork_pool
+
+
+# Same defaults as statsmodels' Poisson.fit(method='newton').
+MAXITER = 35
+TOLERANCE = 1e-8
+
+
+class PoissonDesign:
+    """A regression formula parsed once, to build the matrices of any lexicon.
+
+    Parameters
+    ----------
+    formula: str
+       patsy formula, e.g. 'num_homophones ~ num_sylls_est + surprisal'
+    df: pd.DataFrame
+       lexicon the formula is first evaluated on; categorical levels come from it
+    """
+
+    def __init__(self, formula, df):
+        self.formula = formula
+        y, X = patsy.dmatrices(formula, df, return_type='matrix')
+        self.design_infos = [y.design_info, X.design_info]
+        self.columns = list(X.design_info.column_names)
+        self.first = (np.asarray(y)[:, 0], np.asarray(X))
+
+    def matrices(self, df):
+        """Response and design matrix of a lexicon (rows with missing values dropped)."""
+        y, X = patsy.build_design_matrices(self.design_infos, df)
+        return np.asarray(y)[:, 0], np.asarray(X)
+
+
+def fit_poisson(y, X, maxiter=MAXITER, tol=TOLERANCE):
+    """Maximum-likelihood coefficients of a Poisson regression of y on X, by Newton's method."""
+    # Least squares on log(y + .5) starts close to the optimum.
+    params = np.linalg.lstsq(X, np.log(y + .5), rcond=None)[0]
+    for _ in range(maxiter):
+        mu = np.exp(X @ params)
+        step = np.linalg.solve((X * mu[:, None]).T @ X, X.T @ (y - mu))
+        params = params + step
+        if np.max(np.abs(step)) < tol:
+            return params
+    warnings.warn("Poisson regression did not converge in {m} iterations.".format(m=maxiter), RuntimeWarning)
+    return params
+
+
+def _fit(matrices):
+    return fit_poisson(*matrices)
+
+
+def fit_lexica(formula, df_real, list_of_artificials, processes=None):
+    """Coefficients of formula for the real lexicon and every artificial one.
+
+    Parameters
+    ----------
+    formula: str
+       patsy formula of the Poisson regression
+    df_real: pd.DataFrame
+       real lexicon; the formula is parsed on it
+    list_of_artificials: iterable of pd.DataFrame
+       artificial lexica, with the columns the formula uses
+    processes: int (default None)
+       number of worker processes; None uses every core, 1 fits in this process
+
+    Returns
+    -------
+    pd.DataFrame
+       one row of coefficients per lexicon, the real one first, and column
+       'real' ("Yes" or "No"), like utils.analyze_stats
+    """
+    design = PoissonDesign(formula, df_real)
+    jobs = _jobs(design, list_of_artificials)
+    if processes == 1:
+        coefs = [_fit(job) for job in jobs]
+    else:
+        with fork_pool(processes) as pool:
+            coefs = list(pool.imap(_fit, jobs))
+    df = pd.DataFrame(coefs, columns=design.columns)
+    df['real'] = ["Yes"] + ["No"] * (len(df) - 1)
+    return df
+
+
+def _jobs(design, list_of_artificials):
+    """Matrices of each lexicon, built in this process (patsy designs cannot be pickled)."""
+    yield design.first
+    for df_art in list_of_artificials:
+        yield design.matrices(df_art)
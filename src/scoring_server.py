@@ -0,0 +1,282 @@
+"""Local HTTP service scoring and generating wordforms with warm phonotactic models.
+
+One long-running process holds a compiled model per language (loaded from a
+saved model, or trained once through the model cache), so notebooks and scripts
+can share it instead of each reloading a lexicon and retraining. Requests are
+JSON over localhost:
+
+    POST /score     {"language": "english", "wordforms": ["kat", ...]}
+    POST /generate  {"language": "english", "size": 10, "seed": 1}
+    GET  /stats     latency percentiles and batch sizes
+    GET  /models    languages served
+
+Score requests arriving together are coalesced into a single vectorized
+evaluate_batch call per model. ScoringClient wraps the requests for Python.
+
+Run from the root of the repository:
+
+    python src/scoring_server.py --lexicon english=data/processed/english/english_all_reals.csv
+    python src/scoring_server.py --model english=data/cache/models/<key> --port 8765
+"""
+
+import argparse
+import collections
+import json
+import queue
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pandas as pd
+
+import config
+from compiled_model import CompiledNgramModel
+from model_cache import ModelCache
+from preprocess import create_model, training_wordforms
+
+
+HOST = "127.0.0.1"
+PORT = 8765
+
+
+class BatchScorer:
+    """Score wordforms with a model, merging requests that arrive together into one call.
+
+    A background thread takes the first waiting request, then keeps collecting
+    requests for up to max_wait seconds (or until max_words wordforms), scores
+    them all with one evaluate_batch, and hands each request its slice.
+
+    Parameters
+    ----------
+    model: CompiledNgramModel
+       model to score with
+    max_words: int (default 100000)
+       most wordforms scored in one call
+    max_wait: float (default .002)
+       seconds to wait for more requests once one has arrived
+    """
+
+    def __init__(self, model, max_words=100000, max_wait=.002):
+        self.model = model
+        self.max_words = max_words
+        self.max_wait = max_wait
+        self.requests = queue.Queue()
+        self.batch_sizes = collections.deque(maxlen=10000)
+        # Generation draws from lazily built tables, so it is serialized.
+        self.generate_lock = threading.Lock()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def score(self, wordforms):
+        """(lengths, OOV counts, log10 probabilities) of wordforms, as lists.
+
+        wordforms are checked here, before they join a batch, so a malformed
+        request fails on its own rather than failing every request scored with it."""
+        if isinstance(wordforms, str) or not all(isinstance(w, str) for w in wordforms):
+            raise TypeError("wordforms must be a list of strings")
+        request = {'wordforms': list(wordforms), 'done': threading.Event()}
+        self.requests.put(request)
+        request['done'].wait()
+        if 'error' in request:
+            raise request['error']
+        return request['result']
+
+    def generate(self, size, seed=None):
+        with self.generate_lock:
+            words, log_probs = self.model.generate_batch(size, rng=seed)
+        return words, log_probs.tolist()
+
+    def _run(self):
+        while True:
+            batch = [self.requests.get()]
+            num_words = len(batch[0]['wordforms'])
+            deadline = time.perf_counter() + self.max_wait
+            while num_words < self.max_words:
+                try:
+                    request = self.requests.get(timeout=max(deadline - time.perf_counter(), 0))
+                except queue.Empty:
+                    break
+                batch.append(request)
+                num_words += len(request['wordforms'])
+            self._score(batch)
+
+    def _score(self, batch):
+        try:
+            wordforms = [w for request in batch for w in request['wordforms']]
+            lengths, oov, log_probs = self.model.evaluate_batch(wordforms)
+            self.batch_sizes.append((len(batch), len(wordforms)))
+            start = 0
+            for request in batch:
+                rows = slice(start, start + len(request['wordforms']))
+                request['result'] = (lengths[rows].tolist(), oov[rows].tolist(), log_probs[rows].tolist())
+                start = rows.stop
+        except Exception as error:
+            for request in batch:
+                request['error'] = error
+        for request in batch:
+            request['done'].set()
+
+
+class LatencyStats:
+    """Latencies of the most recent requests of each endpoint."""
+
+    def __init__(self, size=10000):
+        self.latencies = collections.defaultdict(lambda: collections.deque(maxlen=size))
+        self.counts = collections.Counter()
+        self.lock = threading.Lock()
+
+    def add(self, endpoint, seconds):
+        with self.lock:
+            self.latencies[endpoint].append(seconds)
+            self.counts[endpoint] += 1
+
+    def summary(self, percentiles=(50, 90, 99)):
+        """Requests served and latency percentiles (in milliseconds) per endpoint."""
+        with self.lock:
+            latencies = {endpoint: np.array(values) for endpoint, values in self.latencies.items()}
+            counts = dict(self.counts)
+        return {endpoint: dict({'requests': counts[endpoint]},
+                               **{'p{q}_ms'.format(q=q): float(np.percentile(values, q) * 1000) for q in percentiles})
+                for endpoint, values in latencies.items() if len(values)}
+
+
+class ScoringServer(ThreadingHTTPServer):
+    """HTTP server of the models in scorers ({language: BatchScorer})."""
+
+    daemon_threads = True
+
+    def __init__(self, scorers, host=HOST, port=PORT):
+        super().__init__((host, port), _Handler)
+        self.scorers = scorers
+        self.stats = LatencyStats()
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path == "/stats":
+            batches = {language: list(scorer.batch_sizes) for language, scorer in self.server.scorers.items()}
+            self._reply(200, {'latency': self.server.stats.summary(),
+                              'batches': {language: {'calls': len(sizes),
+                                                     'mean_requests': float(np.mean([r for r, _ in sizes])),
+                                                     'mean_wordforms': float(np.mean([w for _, w in sizes]))}
+                                          for language, sizes in batches.items() if sizes}})
+        elif self.path == "/models":
+            self._reply(200, {language: {'n': scorer.model.n, 'smoothing': scorer.model.smoothing}
+                              for language, scorer in self.server.scorers.items()})
+        else:
+            self._reply(404, {'error': "Unknown path {p}".format(p=self.path)})
+
+    def do_POST(self):
+        start = time.perf_counter()
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b"{}")
+            scorer = self.server.scorers[body.get('language', next(iter(self.server.scorers)))]
+            if self.path == "/score":
+                lengths, oov, log_probs = scorer.score(body['wordforms'])
+                reply = {'length': lengths, 'oov': oov, 'log_prob': log_probs}
+            elif self.path == "/generate":
+                words, log_probs = scorer.generate(int(body.get('size', 1)), seed=body.get('seed'))
+                reply = {'wordforms': words, 'log_prob': log_probs}
+            else:
+                self._reply(404, {'error': "Unknown path {p}".format(p=self.path)})
+                return
+        except (KeyError, ValueError, TypeError, StopIteration) as error:
+            self._reply(400, {'error': repr(error)})
+            return
+        self._reply(200, reply)
+        self.server.stats.add(self.path, time.perf_counter() - start)
+
+    def _reply(self, status, payload):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        # Per-request logging would dominate the latency of small requests.
+        pass
+
+
+class ScoringClient:
+    """Python access to a running ScoringServer."""
+
+    def __init__(self, url="http://{h}:{p}".format(h=HOST, p=PORT), timeout=60):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+
+    def score(self, wordforms, language=None):
+        """Log10 probability of each wordform."""
+        return self._request("/score", {'language': language, 'wordforms': list(wordforms)})['log_prob']
+
+    def generate(self, size, language=None, seed=None):
+        """size generated wordforms and their log10 probabilities."""
+        reply = self._request("/generate", {'language': language, 'size': size, 'seed': seed})
+        return reply['wordforms'], reply['log_prob']
+
+    def stats(self):
+        return self._request("/stats")
+
+    def models(self):
+        return self._request("/models")
+
+    def _request(self, path, payload=None):
+        data = None
+        if payload is not None:
+            data = json.dumps({k: v for k, v in payload.items() if v is not None}).encode("utf-8")
+        request = urllib.request.Request(self.url + path, data=data, headers={'Content-Type': 'application/json'})
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            return json.loads(response.read())
+
+
+def load_scorers(models=(), lexica=(), n=None, smoothing=None, cache_dir=config.MODEL_CACHE_DIR):
+    """BatchScorer per language, from saved models and from lexica trained through the model cache.
+
+    models and lexica are (language, path) pairs: a CompiledNgramModel.save
+    directory, or a CSV file whose config.PHON_COLUMN holds the wordforms. A
+    lexicon is filtered as preprocess_lexicon filters it (see training_wordforms),
+    so the model is the pipeline's and is found in the cache under the same key."""
+    n = config.MODEL_INFO['n'] if n is None else n
+    smoothing = config.MODEL_INFO['smoothing'] if smoothing is None else smoothing
+    cache = ModelCache(cache_dir, config.MODEL_CACHE_BYTES) if cache_dir else None
+    scorers = {language: BatchScorer(CompiledNgramModel.load(path)) for language, path in models}
+    for language, path in lexica:
+        wordforms = training_wordforms(pd.read_csv(path), language, phon_column=config.PHON_COLUMN[language],
+                                       word_column=config.WORD_COLUMN[language], vowels=config.VOWEL_SETS[language])
+        scorers[language] = BatchScorer(create_model(wordforms, n=n, smoothing=smoothing, compiled=True, cache=cache))
+    return scorers
+
+
+def _pair(text):
+    language, _, path = text.partition("=")
+    if not path:
+        raise argparse.ArgumentTypeError("Expected LANGUAGE=PATH, got {t}".format(t=text))
+    return language, path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve phonotactic scores and generated wordforms over localhost.")
+    parser.add_argument('--model', type=_pair, action='append', default=[], metavar="LANGUAGE=DIR",
+                        help="saved compiled model")
+    parser.add_argument('--lexicon', type=_pair, action='append', default=[], metavar="LANGUAGE=CSV",
+                        help="lexicon to train on (through the model cache)")
+    parser.add_argument('--n', type=int, default=None)
+    parser.add_argument('--smoothing', type=float, default=None)
+    parser.add_argument('--host', default=HOST)
+    parser.add_argument('--port', type=int, default=PORT)
+    args = parser.parse_args()
+    if not args.model and not args.lexicon:
+        parser.error("give at least one --model or --lexicon")
+
+    server = ScoringServer(load_scorers(args.model, args.lexicon, n=args.n, smoothing=args.smoothing),
+                           host=args.host, port=args.port)
+    print("Serving {langs} on http://{h}:{p}".format(langs=", ".join(server.scorers), h=args.host, p=args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -1,21 +1,29 @@
-"""Utility functions for preprocessing and analysis"""
+"""Utility functions for preprocessing and analysis
+
+scipy.stats, statsmodels, matplotlib and the regression module are only needed
+for analysis, so they are imported by the functions that use them; generation
+and minimal-pair scripts importing this module do not pay for them. The other
+modules of src/ are imported the same way, through _local, so the notebooks can
+import this module as src.utils from the root of the repository."""
+
+import importlib
 
 import pandas as pd
 import numpy as np 
-import scipy.stats as ss
 
-import statsmodels.formula.api as sm
+from tqdm import tqdm
 
-import matplotlib.pyplot as plt
 
-from tqdm import tqdm
+def _local(module):
+    """Module of src/, whether src/ is on the path or this module was imported as src.utils."""
+    return importlib.import_module("." + module, __package__) if __package__ else importlib.import_module(module)
 
 
 def get_homophone_counts(df, column="PhonDISC"):
     """Return a Series mapping each form to the number of occurrences.
     Use stressed or unstressed?
     """
-    return df.groupby(column).size() - 1
+    return _local('homophones').HomophoneIndex.from_values(df[column]).homophone_counts().sort_index()
 
 
 def remove_word(word):
@@ -39,14 +47,13 @@ def preprocess_for_analysis(df, word_column="Word", phon_column='PhonDISC', verb
     if verbose:
         print("Number of tokens: {t}".format(t = len(df)))
 
-    # Get number of homophones
-    phone_counts = get_homophone_counts(df, column=phon_column)
-    # Merge together
-    df['num_homophones'] = df[phon_column].apply(lambda x: phone_counts[x])
+    # Get number of homophones; the same factorization finds the duplicates below
+    homophones = _local('homophones').HomophoneIndex.from_values(df[phon_column])
+    df['num_homophones'] = homophones.num_homophones()
 
     # Remove duplicates now? *** Should this be allowed? If so, how to decide which duplicate to drop?
     # (Depends on what their procedure was)
-    df = df.drop_duplicates(subset=phon_column)
+    df = df[homophones.first_rows()]
     if verbose:
         print("Number of tokens: {t}".format(t = len(df)))
 
@@ -54,6 +61,8 @@ def preprocess_for_analysis(df, word_column="Word", phon_column='PhonDISC', verb
 
 def agg_homophones_by_syllable(dataframe, syl_column = "NSyll", homophone_column='num_homophones'):
     """Aggregate homophones by number of syllables."""
+    import scipy.stats as ss
+
     means_table = pd.pivot_table(dataframe, values=homophone_column,
                columns=syl_column,
                aggfunc=np.mean)
@@ -94,75 +103,82 @@ def count_syllables(word, language, vowels="IE{VQU@i#$u312456789cq0~"):
     return counts
 
 
+def vowel_lookup(vowels, size):
+    """Boolean table over character codes below size: True for the vowels."""
+    table = np.zeros(size, dtype=bool)
+    codes = [ord(v) for v in vowels if ord(v) < size]
+    table[codes] = True
+    return table
+
+
+def count_syllables_batch(wordforms, language, vowels="IE{VQU@i#$u312456789cq0~"):
+    """count_syllables of many wordforms at once, as an integer array.
+
+    Characters are integer-coded in one pass, so the vowel test is a lookup in a
+    table over the distinct codes, and geminates a comparison with the previous
+    code of the same word."""
+    wordforms = wordforms.tolist() if hasattr(wordforms, 'tolist') else list(wordforms)
+    lengths = np.array([len(w) for w in wordforms], dtype=np.int64)
+    points = np.frombuffer("".join(wordforms).encode("utf-32-le"), dtype=np.uint32)
+    is_vowel = vowel_lookup(vowels, points.max() + 1 if len(points) else 0)[points]
+    syllabic = is_vowel
+    if language in ['japanese']:
+        # Count geminates ('tt', 'kk') for additional mora.
+        repeated = np.zeros(len(points), dtype=bool)
+        repeated[1:] = points[1:] == points[:-1]
+        starts = np.cumsum(lengths) - lengths
+        repeated[starts[lengths > 0]] = False
+        syllabic = is_vowel | repeated
+    totals = np.concatenate([[0], np.cumsum(syllabic)])
+    ends = np.cumsum(lengths)
+    return totals[ends] - totals[ends - lengths]
+
+
 
 ######### Utils for analysis ############
 
 def get_homophone_stats(df_lex):
     """Return basic stats about lexicon. Number of homophones, etc."""
-    return {'homophone_percentage': round((len(df_lex[df_lex['num_homophones']>0]) / len(df_lex)), 4),
-            'mean_homophones': round(df_lex['num_homophones'].mean(), 4),
-            'max_homophones': round(df_lex['num_homophones'].max(), 2)}
+    return _single_lexicon_stats(df_lex, _local('lexicon_stats').STATISTICS[:3])
 
 
 def get_stats_for_lexicon(df_lex):
     """Return basic stats about lexicon. Number of homophones, etc."""
-    return {'homophone_percentage': round((len(df_lex[df_lex['num_homophones']>0]) / len(df_lex)), 4),
-            'mean_homophones': round(df_lex['num_homophones'].mean(), 4),
-            'max_homophones': round(df_lex['num_homophones'].max(), 2),
-            'mean_mp': round(df_lex['neighborhood_size'].mean(), 4),
-            'max_mp': round(df_lex['neighborhood_size'].max(), 2),
-            'total_mp': round(df_lex['neighborhood_size'].sum(), 2),
-            'mean_mp_w_hp': round(df_lex['neighborhood_size_with_homophones'].mean(), 4),
-            'max_mp_w_hp': round(df_lex['neighborhood_size_with_homophones'].max(), 2),
-            'total_mp_w_hp': round(df_lex['neighborhood_size_with_homophones'].sum(), 2)}
+    return _single_lexicon_stats(df_lex, _local('lexicon_stats').STATISTICS)
+
+
+def _single_lexicon_stats(df_lex, statistics):
+    stats = _local('lexicon_stats').lexicon_stats(df_lex, by=None, statistics=statistics)
+    return {name: stats[name].iloc[0] for name in stats.columns}
+
 
 def process_and_extract_artificials(df_artificials, N=10):
     """Extract each artificial lexicon from aggregated dataframe.
     
-    Also returns information about homophony distribution and minimal pair distribution.
+    Also returns information about homophony distribution and minimal pair distribution,
+    computed for all lexica at once by lexicon_stats.LexiconStats.
     """
+    lexicon_stats = _local('lexicon_stats')
     processed_artificials = []
-    homophone_percentages = []
-    mean_homophones, max_homophones = [], []
-    mean_mp, max_mp, total_mp = [], [], []
-    # Neighborhood size with homophones
-    mean_mp_hp, max_mp_hp, total_mp_hp = [], [], []
-    for i in tqdm(range(N)):
-
-        df_tmp = df_artificials[df_artificials['lexicon']==i]
-
-        df_tmp_processed = utils.preprocess_for_analysis(df_tmp,
-                                                          phon_column="word", word_column="word")
-        
-        lex_stats = get_stats_for_lexicon(df_tmp_processed)
-
-        homophone_percentages.append(lex_stats['homophone_percentage'])
-        mean_homophones.append(lex_stats['mean_homophones'])
-        max_homophones.append(lex_stats['max_homophones'])
-        mean_mp.append(lex_stats['mean_mp'])
-        max_mp.append(lex_stats['max_mp'])
-        total_mp.append(lex_stats['total_mp'])
-        mean_mp_hp.append(lex_stats['mean_mp_w_hp'])
-        max_mp_hp.append(lex_stats['max_mp_w_hp'])
-        total_mp_hp.append(lex_stats['total_mp_w_hp'])
-        
+    accumulator = lexicon_stats.LexiconStats(by='lexicon', statistics=lexicon_stats.STATISTICS)
+    for df_tmp in tqdm(_local('lexicon_store').split_lexica(df_artificials, N), total=N):
+
+        df_tmp_processed = preprocess_for_analysis(df_tmp,
+                                                   phon_column="word", word_column="word")
+        accumulator.update(df_tmp_processed)
         processed_artificials.append(df_tmp_processed)
-    
-    return {'processed_dataframes': processed_artificials,
-            'homophone_percentages': homophone_percentages,
-            'mean_homophones': mean_homophones,
-            'max_homophones': max_homophones,
-            'mean_mp': mean_mp,
-            'max_mp': max_mp,
-            'total_mp': total_mp,
-            'mean_mp_w_hp': mean_mp_hp,
-            'max_mp_w_hp': max_mp_hp,
-            'total_mp_w_hp': total_mp_hp
-           }
+
+    stats = accumulator.result()
+    info = {'processed_dataframes': processed_artificials}
+    for name in stats.columns:
+        info['homophone_percentages' if name == 'homophone_percentage' else name] = stats[name].tolist()
+    return info
     
 
 def plot_real_vs_art(art_dist, real_value, statistic, language, ylabel="Count"):
     """Compare distribution of test statistics from artificial lexicon to real lexicon."""
+    import matplotlib.pyplot as plt
+
     plt.hist(art_dist)
     plt.title("{lan}: {x} (real vs. artificial)".format(lan=language, x=statistic))
     plt.xlabel(statistic)
@@ -175,13 +191,16 @@ def load_lexicons_for_language(language, phon_column="PhonDISC", word_column="Wo
     df_real = pd.read_csv("data/processed/{lan1}/minimal_pairs/{lan2}_all_mps.csv".format(lan1=language,
                                                                                          lan2=language))
     df_real_processed = preprocess_for_analysis(df_real, word_column=word_column, phon_column=phon_column)
-    df_artificials = pd.read_csv("data/processed/{lan1}/minimal_pairs/{lan2}_artificial_10_matched_on_sylls_mps.csv".format(lan1=language,
-                                                                                                                           lan2=language))
+    # Read from the columnar lexicon set instead when the lexica were saved that way
+    df_artificials = _local('lexicon_store').load_artificials("data/processed/{lan1}/minimal_pairs/{lan2}_artificial_10_matched_on_sylls_mps.csv".format(lan1=language,
+                                                                                                                                 lan2=language))
     return df_real, df_real_processed, df_artificials
 
 
 def analyze_stats_for_single(df, formula, covariates):
     """Analyze stats for single lexicon."""
+    import statsmodels.formula.api as sm
+
     result_real = sm.poisson(formula=formula, 
                 data=df).fit(disp=0)
     
@@ -194,29 +213,18 @@ def analyze_stats_for_single(df, formula, covariates):
     return pd.DataFrame(coefs)   
 
 
-def analyze_stats(df_og, list_of_artificials, formula, covariates):
-    """Analyze stats for real vs artificial dataframes."""
-    result_real = sm.poisson(formula=formula, 
-                data=df_og).fit(disp=0)
-    
-    params = result_real.params
-    params['real'] = "Yes"
-    
-    coefs = []
-    coefs.append(params)
-    
-    for df_art in list_of_artificials:
-        result_fake = sm.poisson(formula=formula, 
-                data=df_art).fit(disp=0)
-        params = result_fake.params
-        params['real'] = "No"
-        coefs.append(params)
-    
-    return pd.DataFrame(coefs)
+def analyze_stats(df_og, list_of_artificials, formula, covariates, processes=None):
+    """Analyze stats for real vs artificial dataframes.
+
+    The formula is parsed once and the regressions are fit in a pool of
+    processes (see regression.fit_lexica); processes=1 fits them serially."""
+    return _local('regression').fit_lexica(formula, df_og, list_of_artificials, processes=processes)
     
 
 def process_stats(df_real, list_of_fakes, formula, covariates, covariate_labels, language):
     """Pipeline for processing and plotting stats results."""
+    import matplotlib.pyplot as plt
+
     df_stats = analyze_stats(df_real, list_of_fakes, formula=formula, covariates=covariates)
     fig = plt.figure()
     fig.set_figheight(10)